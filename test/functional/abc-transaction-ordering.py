@@ -12,6 +12,7 @@ import time
 from collections import deque
 
 from test_framework.blocktools import (
+    IncrementalMerkleTree,
     create_block,
     create_coinbase,
     make_conform_to_ctor,
@@ -41,10 +42,6 @@ class TransactionOrderingTest(BitcoinTestFramework):
         self.extra_args = [['-whitelist=noban@127.0.0.1',
                             '-allownonstdtxnconsensus=1']]
 
-    def add_transactions_to_block(self, block, tx_list):
-        [tx.rehash() for tx in tx_list]
-        block.vtx.extend(tx_list)
-
     def next_block(self, number, spend=None, tx_count=0):
         if self.tip is None:
             base_block_hash = self.genesis_hash
@@ -64,6 +61,8 @@ class TransactionOrderingTest(BitcoinTestFramework):
             coinbase.vout[0].nValue += spend.tx.vout[spend.n].nValue // 2
             coinbase.rehash()
             block = create_block(base_block_hash, coinbase, height, block_time)
+            # Only rehash the merkle nodes above each added transaction
+            tree = IncrementalMerkleTree(block)
 
             # Make sure we have plenty enough to spend going forward.
             spendable_outputs = deque([spend])
@@ -92,18 +91,17 @@ class TransactionOrderingTest(BitcoinTestFramework):
             tx.rehash()
 
             # Add the transaction to the block
-            self.add_transactions_to_block(block, [tx])
+            tree.append(tx)
 
             # If we have a transaction count requirement, just fill the block
             # until we get there
-            while len(block.vtx) < tx_count:
+            while len(tree) < tx_count:
                 # Create the new transaction and add it.
                 tx = get_base_transaction()
-                self.add_transactions_to_block(block, [tx])
+                tree.append(tx)
 
-            # Now that we added a bunch of transaction, we need to recompute
-            # the merkle root.
-            block.hashMerkleRoot = block.calc_merkle_root()
+            # The merkle tree followed the transactions as they were added.
+            block.hashMerkleRoot = tree.calc_merkle_root()
 
         if tx_count > 0:
             assert_equal(len(block.vtx), tx_count)
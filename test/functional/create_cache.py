@@ -9,14 +9,25 @@ multiple functional tests. This helper script is executed by test_runner when mu
 tests are being run in parallel.
 """
 
-from test_framework.test_framework import BitcoinTestFramework
+from test_framework.test_framework import (
+    CHAIN_CACHE_PROFILES,
+    DEFAULT_CHAIN_CACHE_PROFILE,
+    BitcoinTestFramework,
+)
 
 
 class CreateCache(BitcoinTestFramework):
     # Test network and test nodes are not required:
 
+    def add_options(self, parser):
+        parser.add_argument("--cacheprofile", dest="cacheprofile",
+                            default=DEFAULT_CHAIN_CACHE_PROFILE,
+                            choices=sorted(CHAIN_CACHE_PROFILES),
+                            help="The pre-mined chain to create the cache for")
+
     def set_test_params(self):
         self.num_nodes = 0
+        self.chain_cache_profile = self.options.cacheprofile
 
     def setup_network(self):
         pass
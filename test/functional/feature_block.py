@@ -55,16 +55,16 @@ class CBrokenBlock(CBlock):
         self.vtx = copy.deepcopy(base_block.vtx)
         self.hashMerkleRoot = self.calc_merkle_root()
 
-    def serialize(self):
-        r = b""
-        r += super(CBlock, self).serialize()
+    def serialize_into(self, r):
+        super(CBlock, self).serialize_into(r)
         r += struct.pack("<BQ", 255, len(self.vtx))
         for tx in self.vtx:
-            r += tx.serialize()
-        return r
+            tx.serialize_into(r)
 
     def normal_serialize(self):
-        return super().serialize()
+        r = bytearray()
+        super().serialize_into(r)
+        return bytes(r)
 
 
 # Valid for block at height 120
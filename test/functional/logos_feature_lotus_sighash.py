@@ -55,7 +55,7 @@ from test_framework.script import (
     SIGHASH_NONE,
     SIGHASH_SINGLE,
     SIGHASH_FORKID,
-    SignatureHashLotus,
+    LotusSighashContext,
 )
 from test_framework.test_framework import BitcoinTestFramework
 
@@ -349,12 +349,11 @@ class Bip341Sighash(BitcoinTestFramework):
                     'amount': Decimal(spent_output.nValue) / COIN,
                     'scriptPubKey': spent_output.scriptPubKey.hex(),
                 })
+            sighash_context = LotusSighashContext(tx, spent_outputs)
             for i, sig_hash_type in enumerate(test_case['sig_hash_types']):
                 # Compute sighash for this input; we sign it manually using sign_ecdsa/sign_schnorr
                 # and then broadcast the complete transaction
-                sighash = SignatureHashLotus(
-                    tx_to=tx,
-                    spent_utxos=spent_outputs,
+                sighash = sighash_context.sighash(
                     sig_hash_type=sig_hash_type,
                     input_index=i,
                     executed_script_hash=hash256(executed_scripts[key_idx]),
@@ -387,9 +386,7 @@ class Bip341Sighash(BitcoinTestFramework):
                     signed_tx.deserialize(io.BytesIO(bytes.fromhex(raw_tx_signed)))
                     sig = list(CScript(signed_tx.vin[i].scriptSig))[0]
                     pubkey = private_keys[key_idx].get_pubkey()
-                    sighash = SignatureHashLotus(
-                        tx_to=tx,
-                        spent_utxos=spent_outputs,
+                    sighash = sighash_context.sighash(
                         sig_hash_type=sig_hash_type & 0xff,
                         input_index=i,
                         executed_script_hash=hash256(executed_scripts[key_idx]),
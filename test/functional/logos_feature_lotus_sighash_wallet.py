@@ -27,7 +27,7 @@ from test_framework.script import (
     SIGHASH_NONE,
     SIGHASH_SINGLE,
     SIGHASH_FORKID,
-    SignatureHashLotus,
+    LotusSighashContext,
 )
 from test_framework.test_framework import BitcoinTestFramework
 
@@ -103,6 +103,7 @@ class Bip341SighashWallet(BitcoinTestFramework):
                            CScript(bytes.fromhex(spent_output['scriptPubKey'])))
                 )
             unsigned_tx = tx.serialize().hex()
+            sighash_context = LotusSighashContext(tx, spent_outputs_deser)
             for i, sig_hash_type in enumerate(test_case['sig_hash_types']):
                 # Sign transaction using wallet
                 raw_signed_tx = node.signrawtransactionwithwallet(unsigned_tx, None, sig_hash_type)['hex']
@@ -115,9 +116,7 @@ class Bip341SighashWallet(BitcoinTestFramework):
                 pubkey.set(stack_items[1])
                 sig_hash_type_int = self.parse_sig_hash_type(sig_hash_type)
                 # Build expected sighash
-                sighash = SignatureHashLotus(
-                    tx_to=tx,
-                    spent_utxos=spent_outputs_deser,
+                sighash = sighash_context.sighash(
                     sig_hash_type=sig_hash_type_int,
                     input_index=i,
                     executed_script_hash=hash256(spent_outputs_deser[i].scriptPubKey),
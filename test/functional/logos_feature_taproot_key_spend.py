@@ -40,7 +40,7 @@ from test_framework.script import (
     SIGHASH_FORKID,
     SIGHASH_NONE,
     SIGHASH_SINGLE,
-    SignatureHashLotus,
+    LotusSighashContext,
 )
 from test_framework.test_framework import BitcoinTestFramework
 
@@ -222,12 +222,11 @@ class TaprootKeySpendTest(BitcoinTestFramework):
                     tx.vin[i].scriptSig = CScript([sig])
                     key_idx += 1
             else:
+                sighash_context = LotusSighashContext(tx, spent_outputs)
                 for i, sig_hash_type in enumerate(test_case['sig_hash_types']):
                     # Compute sighash for this input; we sign it manually using sign_ecdsa/sign_schnorr
                     # and then broadcast the complete transaction
-                    sighash = SignatureHashLotus(
-                        tx_to=tx,
-                        spent_utxos=spent_outputs,
+                    sighash = sighash_context.sighash(
                         sig_hash_type=sig_hash_type,
                         input_index=i,
                     )
@@ -55,7 +55,7 @@ from test_framework.script import (
     SIGHASH_NONE,
     SIGHASH_SINGLE,
     SIGHASH_FORKID,
-    SignatureHashLotus,
+    LotusSighashContext,
     SignatureHashForkId,
     TaggedHash,
 )
@@ -466,6 +466,7 @@ class TaprootScriptSpendTest(BitcoinTestFramework):
             for _ in range(num_inputs):
                 tx.vin.append(CTxIn(COutPoint(tx_fan_out.txid, utxo_idx), CScript()))
                 utxo_idx += 1
+            sighash_context = LotusSighashContext(tx, spent_outputs)
             for input_idx, input_case in enumerate(tx_case['inputs']):
                 tree, leaf_idx, sig_hash_types = input_case
                 tree_result = taproot_tree_helper(tree)
@@ -478,9 +479,7 @@ class TaprootScriptSpendTest(BitcoinTestFramework):
                 sigs = []
                 for sig_hash_type, key in zip(sig_hash_types, keys):
                     if sig_hash_type & SIGHASH_LOTUS == SIGHASH_LOTUS:
-                        sighash = SignatureHashLotus(
-                            tx_to=tx,
-                            spent_utxos=spent_outputs,
+                        sighash = sighash_context.sighash(
                             sig_hash_type=sig_hash_type,
                             input_index=input_idx,
                             executed_script_hash=leaf['tapleaf_hash'],
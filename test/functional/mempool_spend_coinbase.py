@@ -12,7 +12,10 @@ in the next block are accepted into the memory pool,
 but less mature coinbase spends are NOT.
 """
 
-from test_framework.test_framework import BitcoinTestFramework
+from test_framework.test_framework import (
+    CHAIN_CACHE_PROFILES,
+    BitcoinTestFramework,
+)
 from test_framework.util import assert_equal, assert_raises_rpc_error
 from test_framework.wallet import MiniWallet
 
@@ -20,43 +23,47 @@ from test_framework.wallet import MiniWallet
 class MempoolSpendCoinbaseTest(BitcoinTestFramework):
     def set_test_params(self):
         self.num_nodes = 1
-        self.setup_clean_chain = True
+        self.chain_cache_profile = "miniwallet"
 
     def run_test(self):
         wallet = MiniWallet(self.nodes[0])
 
-        wallet.generate(200)
+        # The cached chain, plus the block mined by setup_nodes()
         chain_height = self.nodes[0].getblockcount()
-        assert_equal(chain_height, 200)
+        assert_equal(chain_height,
+                     CHAIN_CACHE_PROFILES["miniwallet"].height + 1)
 
         # Coinbase at height chain_height-100+1 ok in mempool, should
         # get mined. Coinbase at height chain_height-100+2 is
         # too immature to spend.
-        b = [self.nodes[0].getblockhash(n) for n in range(101, 103)]
+        wallet.scan_blocks(start=chain_height - 99, num=2)
+        b = [self.nodes[0].getblockhash(n)
+             for n in range(chain_height - 99, chain_height - 97)]
         coinbase_txids = [self.nodes[0].getblock(h)['tx'][0] for h in b]
-        utxo_101 = wallet.get_utxo(txid=coinbase_txids[0])
-        utxo_102 = wallet.get_utxo(txid=coinbase_txids[1])
+        utxo_mature = wallet.get_utxo(txid=coinbase_txids[0])
+        utxo_immature = wallet.get_utxo(txid=coinbase_txids[1])
 
-        spend_101_id = wallet.send_self_transfer(
-            from_node=self.nodes[0], utxo_to_spend=utxo_101)["txid"]
+        spend_mature_id = wallet.send_self_transfer(
+            from_node=self.nodes[0], utxo_to_spend=utxo_mature)["txid"]
 
-        # coinbase at height 102 should be too immature to spend
+        # coinbase at height chain_height-100+2 should be too immature to
+        # spend
         assert_raises_rpc_error(
             -26, "bad-txns-premature-spend-of-coinbase",
             lambda: wallet.send_self_transfer(from_node=self.nodes[0],
-                                              utxo_to_spend=utxo_102))
+                                              utxo_to_spend=utxo_immature))
 
-        # mempool should have just spend_101:
-        assert_equal(self.nodes[0].getrawmempool(), [spend_101_id])
+        # mempool should have just spend_mature:
+        assert_equal(self.nodes[0].getrawmempool(), [spend_mature_id])
 
-        # mine a block, spend_101 should get confirmed
+        # mine a block, spend_mature should get confirmed
         self.nodes[0].generate(1)
         assert_equal(set(self.nodes[0].getrawmempool()), set())
 
-        # ... and now height 102 can be spent:
-        spend_102_id = wallet.send_self_transfer(
-            from_node=self.nodes[0], utxo_to_spend=utxo_102)["txid"]
-        assert_equal(self.nodes[0].getrawmempool(), [spend_102_id])
+        # ... and now the coinbase at height chain_height-100+2 can be spent:
+        spend_immature_id = wallet.send_self_transfer(
+            from_node=self.nodes[0], utxo_to_spend=utxo_immature)["txid"]
+        assert_equal(self.nodes[0].getrawmempool(), [spend_immature_id])
 
 
 if __name__ == '__main__':
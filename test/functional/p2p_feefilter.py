@@ -9,7 +9,10 @@ import time
 
 from test_framework.messages import MSG_TX, msg_feefilter
 from test_framework.p2p import P2PInterface, p2p_lock
-from test_framework.test_framework import BitcoinTestFramework
+from test_framework.test_framework import (
+    MINIWALLET_CACHE_START_HEIGHT,
+    BitcoinTestFramework,
+)
 from test_framework.util import assert_equal
 from test_framework.wallet import MiniWallet
 
@@ -57,6 +60,7 @@ class TestP2PConn(P2PInterface):
 class FeeFilterTest(BitcoinTestFramework):
     def set_test_params(self):
         self.num_nodes = 2
+        self.chain_cache_profile = "miniwallet"
         # We lower the various required feerates for this test
         # to catch a corner-case where feefilter used to slightly undercut
         # mempool and wallet feerate calculation based on GetFee
@@ -96,8 +100,8 @@ class FeeFilterTest(BitcoinTestFramework):
         miniwallet = MiniWallet(node1)
         # Add enough mature utxos to the wallet, so that all txs spend
         # confirmed coins
-        miniwallet.generate(5)
-        node1.generate(100)
+        miniwallet.scan_blocks(
+            start=MINIWALLET_CACHE_START_HEIGHT, num=5)
 
         conn = self.nodes[0].add_p2p_connection(TestP2PConn())
 
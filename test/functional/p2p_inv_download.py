@@ -227,14 +227,14 @@ class InventoryDownloadTest(BitcoinTestFramework):
 
         mock_time = int(time.time() + 1)
         self.nodes[0].setmocktime(mock_time)
-        for i in range(max_getdata_in_flight):
-            p.send_message(msg_inv([CInv(t=context.inv_type, h=invids[i])]))
+        p.send_messages([msg_inv([CInv(t=context.inv_type, h=invids[i])])
+                         for i in range(max_getdata_in_flight)])
         p.sync_with_ping()
         mock_time += context.constants.inbound_peer_delay
         self.nodes[0].setmocktime(mock_time)
         p.wait_until(lambda: p.getdata_count >= max_getdata_in_flight)
-        for i in range(max_getdata_in_flight, len(invids)):
-            p.send_message(msg_inv([CInv(t=context.inv_type, h=invids[i])]))
+        p.send_messages([msg_inv([CInv(t=context.inv_type, h=invids[i])])
+                         for i in range(max_getdata_in_flight, len(invids))])
         p.sync_with_ping()
         self.log.info(
             "No more than {} requests should be seen within {} seconds after announcement".format(
@@ -6,7 +6,10 @@
 
 from test_framework.messages import MSG_TX, CInv, msg_getdata
 from test_framework.p2p import P2PDataStore, p2p_lock
-from test_framework.test_framework import BitcoinTestFramework
+from test_framework.test_framework import (
+    MINIWALLET_CACHE_START_HEIGHT,
+    BitcoinTestFramework,
+)
 from test_framework.util import assert_equal
 from test_framework.wallet import MiniWallet
 
@@ -19,6 +22,7 @@ class P2PNode(P2PDataStore):
 class P2PLeakTxTest(BitcoinTestFramework):
     def set_test_params(self):
         self.num_nodes = 1
+        self.chain_cache_profile = "miniwallet"
 
     def run_test(self):
         # The block and tx generating node
@@ -26,8 +30,8 @@ class P2PLeakTxTest(BitcoinTestFramework):
         miniwallet = MiniWallet(gen_node)
         # Add enough mature utxos to the wallet, so that all txs spend
         # confirmed coins
-        miniwallet.generate(1)
-        gen_node.generate(100)
+        miniwallet.scan_blocks(
+            start=MINIWALLET_CACHE_START_HEIGHT, num=1)
 
         # An "attacking" inbound peer
         inbound_peer = self.nodes[0].add_p2p_connection(P2PNode())
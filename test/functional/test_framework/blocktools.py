@@ -9,18 +9,24 @@ import time
 import unittest
 
 from binascii import a2b_hex
+from bisect import bisect_left
 from decimal import Decimal
 
 from .messages import (
     COIN,
     CBlock,
+    CBlockHeader,
+    CMerkleBlock,
     COutPoint,
+    CPartialMerkleTree,
     CTransaction,
     CTxIn,
     CTxOut,
     FromHex,
+    MerkleTree,
     ToHex,
     hash256,
+    uint256_from_str,
 )
 from .script import (
     OP_1,
@@ -79,6 +85,104 @@ def prepare_block(block):
     block.solve()
 
 
+class IncrementalMerkleTree:
+    """Block merkle tree kept in sync with the transactions of a CBlock.
+
+    Transactions must be added, replaced and removed through this object
+    (which also updates block.vtx), so that only the merkle nodes above the
+    affected leaves are rehashed instead of recomputing calc_merkle_root()
+    from scratch. If a transaction is modified in place, call update() with
+    its index.
+    """
+
+    def __init__(self, block):
+        self.block = block
+        for tx in block.vtx:
+            tx.rehash()
+        self.tree = MerkleTree([tx.get_block_leaf_hash() for tx in block.vtx])
+
+    def __len__(self):
+        return len(self.block.vtx)
+
+    def append(self, tx):
+        tx.rehash()
+        self.block.vtx.append(tx)
+        self.tree.append(tx.get_block_leaf_hash())
+
+    def replace(self, index, tx):
+        tx.rehash()
+        self.block.vtx[index] = tx
+        self.tree[index] = tx.get_block_leaf_hash()
+
+    def update(self, index):
+        self.replace(index, self.block.vtx[index])
+
+    def remove(self, index=-1):
+        """Remove the transaction at index. The transactions after it shift
+        to the left, so all the merkle nodes above them are rehashed: this is
+        only O(log n) for the last transaction, O(n) otherwise."""
+        self.tree.pop(index)
+        return self.block.vtx.pop(index)
+
+    def calc_merkle_root(self):
+        return uint256_from_str(self.tree.root()[0])
+
+    def update_block(self):
+        """Set the block merkle root and size after the transactions changed"""
+        self.block.hashMerkleRoot = self.calc_merkle_root()
+        self.block.update_size()
+
+    def get_partial_merkle_tree(self, txids):
+        """Build the CPartialMerkleTree proving the inclusion of the
+        transactions with the given txids, like CMerkleBlock does in lotusd.
+
+        The leaves of the Lotus partial merkle tree are the txhash and the
+        txid of each transaction, so the layer above them is the one of the
+        block merkle tree."""
+        vtx = self.block.vtx
+        txids = set(txids)
+        # The txid is the right leaf of each pair
+        matches = [2 * i + 1 for i, tx in enumerate(vtx) if tx.txid in txids]
+        num_leaves = 2 * len(vtx)
+
+        def width(height):
+            return (num_leaves + (1 << height) - 1) >> height
+
+        def node_hash(height, pos):
+            if height == 0:
+                tx = vtx[pos // 2]
+                return tx.txid if pos % 2 else tx.txhash
+            return uint256_from_str(self.tree.layers[height - 1][pos])
+
+        pmt = CPartialMerkleTree()
+        pmt.nTransactions = num_leaves
+
+        def traverse(height, pos):
+            first = pos << height
+            i = bisect_left(matches, first)
+            parent_of_match = (i < len(matches)
+                               and matches[i] < first + (1 << height))
+            pmt.vBits.append(parent_of_match)
+            if height == 0 or not parent_of_match:
+                pmt.vHash.append(node_hash(height, pos))
+            else:
+                traverse(height - 1, pos * 2)
+                if pos * 2 + 1 < width(height - 1):
+                    traverse(height - 1, pos * 2 + 1)
+
+        height = 0
+        while width(height) > 1:
+            height += 1
+        traverse(height, 0)
+        return pmt
+
+    def get_merkle_block(self, txids):
+        merkle_block = CMerkleBlock()
+        merkle_block.header = CBlockHeader(self.block)
+        merkle_block.txn = self.get_partial_merkle_tree(txids)
+        return merkle_block
+
+
 def script_coinbase_height(height):
     if height <= 16:
         num = CScriptOp.encode_op_n(height)
@@ -182,22 +286,34 @@ def create_confirmed_utxos(node, count, age=101):
     addr2 = node.getnewaddress()
     if iterations <= 0:
         return utxos
-    for i in range(iterations):
-        t = utxos.pop()
-        inputs = []
-        inputs.append({"txid": t["txid"], "vout": t["vout"]})
-        outputs = {}
-        outputs[addr1] = satoshi_round(t['amount'] / 2)
-        outputs[addr2] = satoshi_round(t['amount'] / 2)
-        raw_tx = node.createrawtransaction(inputs, outputs)
-        ctx = FromHex(CTransaction(), raw_tx)
-        fee = node.calculate_fee(ctx) // 2
-        ctx.vout[0].nValue -= fee
-        # Due to possible truncation, we go ahead and take another satoshi in
-        # fees to ensure the transaction gets through
-        ctx.vout[1].nValue -= fee + 1
-        signed_tx = node.signrawtransactionwithwallet(ToHex(ctx))["hex"]
-        node.sendrawtransaction(signed_tx)
+    # Each step is sent as a batch of RPC calls, the transactions spend
+    # distinct utxos and do not depend on each other.
+    with node.batched() as b:
+        raw_txs = []
+        for i in range(iterations):
+            t = utxos.pop()
+            inputs = []
+            inputs.append({"txid": t["txid"], "vout": t["vout"]})
+            outputs = {}
+            outputs[addr1] = satoshi_round(t['amount'] / 2)
+            outputs[addr2] = satoshi_round(t['amount'] / 2)
+            raw_txs.append(b.createrawtransaction(inputs, outputs))
+    with node.batched() as b:
+        signed_txs = []
+        for raw_tx in raw_txs:
+            ctx = FromHex(CTransaction(), raw_tx.result())
+            fee = node.calculate_fee(ctx) // 2
+            ctx.vout[0].nValue -= fee
+            # Due to possible truncation, we go ahead and take another satoshi
+            # in fees to ensure the transaction gets through
+            ctx.vout[1].nValue -= fee + 1
+            signed_txs.append(b.signrawtransactionwithwallet(ToHex(ctx)))
+    with node.batched() as b:
+        txids = [b.sendrawtransaction(signed_tx.result()["hex"])
+                 for signed_tx in signed_txs]
+    for txid in txids:
+        # Raise if any transaction was rejected
+        txid.result()
 
     while (node.getmempoolinfo()['size'] > 0):
         node.generate(1)
@@ -246,6 +362,58 @@ def send_big_transactions(node, utxos, num, fee_multiplier):
 
 
 class TestFrameworkBlockTools(unittest.TestCase):
+    def test_incremental_merkle_tree(self):
+        block = create_block(1, create_coinbase(1), 1, 1)
+        tree = IncrementalMerkleTree(block)
+        for i in range(1, 40):
+            tree.append(create_tx_with_script(
+                block.vtx[i - 1], 0, amount=i))
+            assert_equal(tree.calc_merkle_root(), block.calc_merkle_root())
+        tree.replace(7, create_tx_with_script(block.vtx[3], 0, amount=1))
+        block.vtx[20].nLockTime = 20
+        tree.update(20)
+        assert_equal(tree.calc_merkle_root(), block.calc_merkle_root())
+        for index in (-1, 0, 16, -1, 5):
+            tree.remove(index)
+            assert_equal(tree.calc_merkle_root(), block.calc_merkle_root())
+
+        def extract_matches(pmt):
+            """Python port of CPartialMerkleTree::ExtractMatches"""
+            bits = iter(pmt.vBits)
+            hashes = iter(pmt.vHash)
+            matches = []
+
+            def width(height):
+                return (pmt.nTransactions + (1 << height) - 1) >> height
+
+            def traverse(height, pos):
+                parent_of_match = next(bits)
+                if height == 0 or not parent_of_match:
+                    h = next(hashes)
+                    if height == 0 and parent_of_match:
+                        matches.append((pos // 2, h))
+                    return h
+                left = traverse(height - 1, pos * 2)
+                right = 0
+                if pos * 2 + 1 < width(height - 1):
+                    right = traverse(height - 1, pos * 2 + 1)
+                return uint256_from_str(hash256(
+                    left.to_bytes(32, 'little') + right.to_bytes(32, 'little')))
+
+            height = 0
+            while width(height) > 1:
+                height += 1
+            return traverse(height, 0), matches
+
+        tree.update_block()
+        for picked in ([], [0], [3, 4], [len(tree) - 1], range(len(tree))):
+            txids = [block.vtx[i].txid for i in picked]
+            pmt = tree.get_merkle_block(txids).txn
+            root, matches = extract_matches(pmt)
+            assert_equal(root, block.hashMerkleRoot)
+            assert_equal(matches, [(i, block.vtx[i].txid) for i in picked])
+
+
     def test_create_coinbase(self):
         height = 20
         coinbase_tx = create_coinbase(height=height)
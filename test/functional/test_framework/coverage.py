@@ -10,6 +10,8 @@ testing.
 
 import os
 
+from .authproxy import RPCBatch
+
 REFERENCE_FILENAME = 'rpc_interface.txt'
 
 
@@ -63,6 +65,9 @@ class AuthServiceProxyWrapper():
         self._log_call()
         return self.auth_service_proxy_instance.get_request(*args, **kwargs)
 
+    def batched(self, *args, **kwargs):
+        return RPCBatch(self, *args, **kwargs)
+
 
 def get_filename(dirname, n_node):
     """
@@ -7,10 +7,17 @@
 WARNING: This code is slow, uses bad randomness, does not properly protect
 keys, and is trivially vulnerable to side channel attacks. Do not use for
 anything but tests.
+
+The signing, verification and public key operations can be delegated to a
+libsecp256k1 shared library, see set_native_backend(). The pure Python
+implementation remains the reference.
 """
 
+import ctypes
 import hashlib
+import os
 import random
+import unittest
 
 from .util import modinv
 
@@ -48,12 +55,44 @@ def modsqrt(a, p):
     return None
 
 
+# Window of the wNAF representation used for variable base points: 2**(w-2)
+# odd multiples of each point are precomputed.
+WNAF_WINDOW = 5
+# Window (in bits) of the fixed base point tables: one table row of
+# 2**w - 1 points per window.
+FIXED_BASE_WINDOW = 4
+
+
+def wnaf(n, w):
+    """Compute the width-w non-adjacent form of n >= 0
+
+    Returns the list of digits, least significant first. Each digit is either
+    zero or odd with an absolute value below 2**(w-1), and any w consecutive
+    digits contain at most one non-zero digit.
+    """
+    assert n >= 0
+    digits = []
+    while n:
+        if n & 1:
+            d = n & ((1 << w) - 1)
+            if d >= 1 << (w - 1):
+                d -= 1 << w
+            n -= d
+        else:
+            d = 0
+        digits.append(d)
+        n >>= 1
+    return digits
+
+
 class EllipticCurve:
     def __init__(self, p, a, b):
         """Initialize elliptic curve y^2 = x^3 + a*x + b over GF(p)."""
         self.p = p
         self.a = a % p
         self.b = b % p
+        # Precomputed tables of the fixed base points, built on first use
+        self.fixed_bases = {}
 
     def affine(self, p1):
         """Convert a Jacobian point tuple p1 to affine form, or None if at infinity."""
@@ -65,6 +104,31 @@ class EllipticCurve:
         inv_3 = (inv_2 * inv) % self.p
         return ((inv_2 * x1) % self.p, (inv_3 * y1) % self.p, 1)
 
+    def batch_affine(self, ps):
+        """Convert a list of Jacobian tuples to affine form, using a single
+        modular inversion (Montgomery's trick). Points at infinity are kept
+        as they are."""
+        prods = []
+        acc = 1
+        for (_, _, z) in ps:
+            if z != 0:
+                acc = (acc * z) % self.p
+            prods.append(acc)
+        inv = modinv(acc, self.p)
+        ret = [None] * len(ps)
+        for i in range(len(ps) - 1, -1, -1):
+            x, y, z = ps[i]
+            if z == 0:
+                ret[i] = ps[i]
+                continue
+            # inv is the inverse of prods[i], so this is the inverse of z
+            inv_z = (inv * (prods[i - 1] if i > 0 else 1)) % self.p
+            inv = (inv * z) % self.p
+            inv_2 = (inv_z**2) % self.p
+            inv_3 = (inv_2 * inv_z) % self.p
+            ret[i] = ((inv_2 * x) % self.p, (inv_3 * y) % self.p, 1)
+        return ret
+
     def negate(self, p1):
         """Negate a Jacobian point tuple p1."""
         x1, y1, z1 = p1
@@ -169,18 +233,95 @@ class EllipticCurve:
         z3 = (h * z1 * z2) % self.p
         return (x3, y3, z3)
 
+    def odd_multiples(self, p1, count):
+        """Compute [p1, 3*p1, 5*p1, ...] (count Jacobian tuples)"""
+        p1_2 = self.double(p1)
+        ret = [p1]
+        for _ in range(count - 1):
+            ret.append(self.add(ret[-1], p1_2))
+        return ret
+
+    def add_fixed_base(self, p1, bits=256):
+        """Register p1 as a fixed base point, so that multiplying it by
+        scalars of up to bits bits uses a precomputed table.
+
+        The table is built on first use. Row i holds d * 2**(w*i) * p1 for
+        d in [1, 2**w), so a multiplication is a sum of one point per window
+        and needs no doubling.
+        """
+        self.fixed_bases[p1] = bits
+
+    def _fixed_base_table(self, p1):
+        table = self.fixed_bases[p1]
+        if isinstance(table, list):
+            return table
+        windows = (table + FIXED_BASE_WINDOW - 1) // FIXED_BASE_WINDOW
+        row_size = (1 << FIXED_BASE_WINDOW) - 1
+        points = []
+        base = p1
+        for _ in range(windows):
+            row = [base]
+            for _ in range(row_size - 1):
+                row.append(self.add(row[-1], base))
+            points.extend(row)
+            base = self.add(row[-1], base)
+        points = self.batch_affine(points)
+        table = [points[i:i + row_size]
+                 for i in range(0, len(points), row_size)]
+        self.fixed_bases[p1] = table
+        return table
+
     def mul(self, ps):
         """Compute a (multi) point multiplication
 
-        ps is a list of (Jacobian tuple, scalar) pairs.
+        ps is a list of (Jacobian tuple, scalar) pairs, with non-negative
+        scalars.
+
+        The multiples of the fixed base points (see add_fixed_base) are
+        looked up in their tables. The other points are multiplied together
+        (Strauss-Shamir), sharing the doublings, using the wNAF of their
+        scalars.
         """
         r = (0, 1, 0)
-        for i in range(255, -1, -1):
-            r = self.double(r)
-            for (p, n) in ps:
-                if ((n >> i) & 1):
-                    r = self.add(r, p)
-        return r
+        var_ps = []
+        var_multiples = []
+        num_multiples = 1 << (WNAF_WINDOW - 2)
+        mask = (1 << FIXED_BASE_WINDOW) - 1
+        for (p, n) in ps:
+            assert n >= 0
+            if n == 0 or p[2] == 0:
+                continue
+            if p in self.fixed_bases:
+                table = self._fixed_base_table(p)
+                if n.bit_length() <= len(table) * FIXED_BASE_WINDOW:
+                    for row in table:
+                        if n & mask:
+                            r = self.add(r, row[(n & mask) - 1])
+                        n >>= FIXED_BASE_WINDOW
+                    continue
+            var_multiples.extend(self.odd_multiples(p, num_multiples))
+            var_ps.append(wnaf(n, WNAF_WINDOW))
+        if not var_ps:
+            return r
+        # Convert the odd multiples of all the points to affine form at once,
+        # then list the points to add after each doubling
+        var_multiples = self.batch_affine(var_multiples)
+        additions = [[] for _ in range(max(map(len, var_ps)))]
+        for j, naf in enumerate(var_ps):
+            offset = j * num_multiples
+            for i, d in enumerate(naf):
+                if d > 0:
+                    additions[i].append(var_multiples[offset + (d >> 1)])
+                elif d < 0:
+                    additions[i].append(
+                        self.negate(var_multiples[offset + (-d >> 1)]))
+
+        acc = (0, 1, 0)
+        for points in reversed(additions):
+            acc = self.double(acc)
+            for p in points:
+                acc = self.add(acc, p)
+        return self.add(acc, r)
 
 
 SECP256K1 = EllipticCurve(2**256 - 2**32 - 977, 0, 7)
@@ -190,6 +331,152 @@ SECP256K1_G = (
     1)
 SECP256K1_ORDER = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
 SECP256K1_ORDER_HALF = SECP256K1_ORDER // 2
+SECP256K1.add_fixed_base(SECP256K1_G)
+
+
+SECP256K1_CONTEXT_VERIFY = (1 << 0) | (1 << 8)
+SECP256K1_CONTEXT_SIGN = (1 << 0) | (1 << 9)
+SECP256K1_EC_COMPRESSED = (1 << 1) | (1 << 8)
+SECP256K1_EC_UNCOMPRESSED = (1 << 1)
+
+
+class NativeSecp256k1():
+    """ctypes binding of the libsecp256k1 shared library, as built from
+    src/secp256k1 with the Schnorr module.
+
+    Keys are passed around serialized, signatures as in the Python
+    implementation. Nonces are drawn from the random module, so that test
+    runs are reproducible from their seed.
+    """
+
+    def __init__(self, path):
+        lib = ctypes.CDLL(path)
+        c_buf = ctypes.c_char_p
+        c_size_p = ctypes.POINTER(ctypes.c_size_t)
+        ctx = ctypes.c_void_p
+        for name, argtypes in [
+            ('secp256k1_ec_pubkey_create', [ctx, c_buf, c_buf]),
+            ('secp256k1_ec_pubkey_parse', [ctx, c_buf, c_buf, ctypes.c_size_t]),
+            ('secp256k1_ec_pubkey_serialize',
+             [ctx, c_buf, c_size_p, c_buf, ctypes.c_uint]),
+            ('secp256k1_ec_pubkey_tweak_add', [ctx, c_buf, c_buf]),
+            ('secp256k1_ecdsa_sign',
+             [ctx, c_buf, c_buf, c_buf, ctypes.c_void_p, c_buf]),
+            ('secp256k1_ecdsa_signature_serialize_der',
+             [ctx, c_buf, c_size_p, c_buf]),
+            ('secp256k1_ecdsa_signature_parse_der',
+             [ctx, c_buf, c_buf, ctypes.c_size_t]),
+            ('secp256k1_ecdsa_signature_normalize', [ctx, c_buf, c_buf]),
+            ('secp256k1_ecdsa_verify', [ctx, c_buf, c_buf, c_buf]),
+            ('secp256k1_schnorr_sign',
+             [ctx, c_buf, c_buf, c_buf, ctypes.c_void_p, c_buf]),
+            ('secp256k1_schnorr_verify', [ctx, c_buf, c_buf, c_buf]),
+        ]:
+            func = getattr(lib, name)
+            func.argtypes = argtypes
+            func.restype = ctypes.c_int
+        lib.secp256k1_context_create.argtypes = [ctypes.c_uint]
+        lib.secp256k1_context_create.restype = ctypes.c_void_p
+        self.lib = lib
+        self.ctx = lib.secp256k1_context_create(
+            SECP256K1_CONTEXT_SIGN | SECP256K1_CONTEXT_VERIFY)
+
+    def _nonce_data(self):
+        return random.getrandbits(256).to_bytes(32, 'big')
+
+    def _parse_pubkey(self, data):
+        pubkey = ctypes.create_string_buffer(64)
+        if data is None or not self.lib.secp256k1_ec_pubkey_parse(
+                self.ctx, pubkey, data, len(data)):
+            return None
+        return pubkey
+
+    def _serialize_pubkey(self, pubkey, compressed):
+        out = ctypes.create_string_buffer(65)
+        outlen = ctypes.c_size_t(65)
+        self.lib.secp256k1_ec_pubkey_serialize(
+            self.ctx, out, ctypes.byref(outlen), pubkey,
+            SECP256K1_EC_COMPRESSED if compressed else SECP256K1_EC_UNCOMPRESSED)
+        return out.raw[:outlen.value]
+
+    def pubkey_create(self, secret32, compressed):
+        pubkey = ctypes.create_string_buffer(64)
+        assert self.lib.secp256k1_ec_pubkey_create(self.ctx, pubkey, secret32)
+        return self._serialize_pubkey(pubkey, compressed)
+
+    def pubkey_tweak_add(self, data, tweak32):
+        """Return the compressed serialization of the tweaked key, or None
+        if the tweak is rejected"""
+        pubkey = self._parse_pubkey(data)
+        if pubkey is None or not self.lib.secp256k1_ec_pubkey_tweak_add(
+                self.ctx, pubkey, tweak32):
+            return None
+        return self._serialize_pubkey(pubkey, True)
+
+    def ecdsa_sign(self, secret32, msg32):
+        """Create a low-S DER-encoded ECDSA signature"""
+        sig = ctypes.create_string_buffer(64)
+        assert self.lib.secp256k1_ecdsa_sign(
+            self.ctx, sig, msg32, secret32, None, self._nonce_data())
+        out = ctypes.create_string_buffer(72)
+        outlen = ctypes.c_size_t(72)
+        assert self.lib.secp256k1_ecdsa_signature_serialize_der(
+            self.ctx, out, ctypes.byref(outlen), sig)
+        return out.raw[:outlen.value]
+
+    def ecdsa_verify(self, data, sig, msg32, low_s):
+        pubkey = self._parse_pubkey(data)
+        parsed_sig = ctypes.create_string_buffer(64)
+        if pubkey is None or not self.lib.secp256k1_ecdsa_signature_parse_der(
+                self.ctx, parsed_sig, sig, len(sig)):
+            return False
+        if not low_s:
+            self.lib.secp256k1_ecdsa_signature_normalize(
+                self.ctx, parsed_sig, parsed_sig)
+        return self.lib.secp256k1_ecdsa_verify(
+            self.ctx, parsed_sig, msg32, pubkey) == 1
+
+    def schnorr_sign(self, secret32, msg32):
+        sig = ctypes.create_string_buffer(64)
+        assert self.lib.secp256k1_schnorr_sign(
+            self.ctx, sig, msg32, secret32, None, self._nonce_data())
+        return sig.raw
+
+    def schnorr_verify(self, data, sig, msg32):
+        pubkey = self._parse_pubkey(data)
+        return pubkey is not None and self.lib.secp256k1_schnorr_verify(
+            self.ctx, sig, msg32, pubkey) == 1
+
+
+# The libsecp256k1 backend in use, None for the pure Python implementation
+_native = None
+
+
+def set_native_backend(path):
+    """Use the libsecp256k1 shared library at path for the key operations it
+    supports, or the pure Python implementation if path is None.
+
+    Returns whether the native backend is in use: a library that cannot be
+    loaded, e.g. one built without the Schnorr module, is ignored.
+    """
+    global _native
+    _native = None
+    if path is not None:
+        try:
+            _native = NativeSecp256k1(path)
+        except (OSError, AttributeError):
+            pass
+    return _native is not None
+
+
+def get_native_backend():
+    return _native
+
+
+# The test framework also looks for the library in the build directory, see
+# BitcoinTestFramework.setup()
+if os.getenv("LIBSECP256K1"):
+    set_native_backend(os.getenv("LIBSECP256K1"))
 
 
 class ECPubKey():
@@ -210,8 +497,8 @@ class ECPubKey():
                 self.compressed = False
         elif (len(data) == 33 and (data[0] == 0x02 or data[0] == 0x03)):
             x = int.from_bytes(data[1:33], 'big')
-            if SECP256K1.is_x_coord(x):
-                p = SECP256K1.lift_x(x)
+            p = SECP256K1.lift_x(x)
+            if p is not None:
                 if (p[1] & 1) != (data[0] & 1):
                     p = SECP256K1.negate(p)
                 self.p = p
@@ -225,6 +512,12 @@ class ECPubKey():
     def add(self, tweak):
         t = int.from_bytes(tweak, 'big')
         assert t < SECP256K1_ORDER
+        if _native is not None:
+            data = _native.pubkey_tweak_add(self.get_bytes(), tweak)
+            if data is not None:
+                q = ECPubKey()
+                q.set(data)
+                return q
         q = ECPubKey()
         q.p = SECP256K1.affine(SECP256K1.mul([(SECP256K1_G, t), (self.p, 1)]))
         q.valid = True
@@ -287,6 +580,8 @@ class ECPubKey():
             return False
         if low_s and s >= SECP256K1_ORDER_HALF:
             return False
+        if _native is not None and len(msg) == 32:
+            return _native.ecdsa_verify(self.get_bytes(), sig, msg, low_s)
         z = int.from_bytes(msg, 'big')
         w = modinv(s, SECP256K1_ORDER)
         u1 = z * w % SECP256K1_ORDER
@@ -301,6 +596,10 @@ class ECPubKey():
         assert len(sig) == 64
         assert len(msg32) == 32
 
+        # The native implementation hashes the compressed public key
+        if _native is not None and self.compressed:
+            return _native.schnorr_verify(self.get_bytes(), sig, msg32)
+
         Rx = sig[:32]
         s = int.from_bytes(sig[32:], 'big')
         e = int.from_bytes(
@@ -309,7 +608,7 @@ class ECPubKey():
                 self.get_bytes() +
                 msg32).digest(),
             'big')
-        nege = SECP256K1_ORDER - e
+        nege = (SECP256K1_ORDER - e) % SECP256K1_ORDER
 
         R = SECP256K1.affine(SECP256K1.mul([(SECP256K1_G, s), (self.p, nege)]))
 
@@ -321,6 +620,60 @@ class ECPubKey():
         return R[0] == int.from_bytes(Rx, 'big')
 
 
+def verify_schnorr_batch(items):
+    """Verify a list of (ECPubKey, sig, msg32) Schnorr signatures at once.
+
+    Returns the list of the verification results, in the same order.
+
+    All the equations s_i*G = R_i + e_i*P_i are checked together through a
+    random linear combination, as a single multi-scalar multiplication. If
+    the batch fails, it is split in halves which are verified in turn, so
+    that the bad signatures are found with a few more batches.
+    """
+    results = [False] * len(items)
+    terms = []
+    for i, (pubkey, sig, msg32) in enumerate(items):
+        assert pubkey.is_valid
+        assert len(sig) == 64
+        assert len(msg32) == 32
+        r = int.from_bytes(sig[:32], 'big')
+        if r >= SECP256K1.p or not SECP256K1.is_x_coord(r):
+            continue
+        R = SECP256K1.lift_x(r)
+        if jacobi_symbol(R[1], SECP256K1.p) == -1:
+            R = SECP256K1.negate(R)
+        s = int.from_bytes(sig[32:], 'big') % SECP256K1_ORDER
+        e = int.from_bytes(
+            hashlib.sha256(sig[:32] + pubkey.get_bytes() + msg32).digest(),
+            'big') % SECP256K1_ORDER
+        terms.append((i, pubkey.p, R, s, e))
+
+    def verify(terms):
+        # The first signature is not randomized, so a single signature is
+        # checked exactly like ECPubKey.verify_schnorr() does.
+        coeffs = [1] + [random.randrange(1, SECP256K1_ORDER)
+                        for _ in range(len(terms) - 1)]
+        s_sum = 0
+        ps = []
+        for a, (_, P, R, s, e) in zip(coeffs, terms):
+            s_sum += a * s
+            ps.append((R, SECP256K1_ORDER - a))
+            ps.append((P, (SECP256K1_ORDER - a * e) % SECP256K1_ORDER))
+        ps.append((SECP256K1_G, s_sum % SECP256K1_ORDER))
+        return SECP256K1.mul(ps)[2] == 0
+
+    pending = [terms] if terms else []
+    while pending:
+        batch = pending.pop()
+        if verify(batch):
+            for (i, _, _, _, _) in batch:
+                results[i] = True
+        elif len(batch) > 1:
+            pending.append(batch[:len(batch) // 2])
+            pending.append(batch[len(batch) // 2:])
+    return results
+
+
 class ECKey():
     """A secp256k1 private key"""
 
@@ -370,6 +723,9 @@ class ECKey():
         """Compute an ECPubKey object for this secret key."""
         assert(self.valid)
         ret = ECPubKey()
+        if _native is not None:
+            ret.set(_native.pubkey_create(self.get_bytes(), self.compressed))
+            return ret
         p = SECP256K1.mul([(SECP256K1_G, self.secret)])
         ret.p = p
         ret.valid = True
@@ -379,6 +735,8 @@ class ECKey():
     def sign_ecdsa(self, msg, low_s=True):
         """Construct a DER-encoded ECDSA signature with this key."""
         assert(self.valid)
+        if _native is not None and low_s and len(msg) == 32:
+            return _native.ecdsa_sign(self.get_bytes(), msg)
         z = int.from_bytes(msg, 'big')
         # Note: no RFC6979, but a simple random nonce (some tests rely on
         # distinct transactions for the same operation)
@@ -402,6 +760,12 @@ class ECKey():
         pubkey = self.get_pubkey()
         assert pubkey.is_valid
 
+        # The native implementation hashes the compressed public key
+        if _native is not None and self.compressed:
+            sig = _native.schnorr_sign(self.get_bytes(), msg32)
+            assert pubkey.verify_schnorr(sig, msg32)
+            return sig
+
         k = random.randrange(1, SECP256K1_ORDER)
 
         R = SECP256K1.affine(SECP256K1.mul([(SECP256K1_G, k)]))
@@ -421,3 +785,148 @@ class ECKey():
 
         assert pubkey.verify_schnorr(sig, msg32)
         return sig
+
+
+class TestFrameworkKey(unittest.TestCase):
+    def test_wnaf(self):
+        for n in [0, 1, 2, 15, 16, 17, 2**256 - 1,
+                  random.randrange(SECP256K1_ORDER)]:
+            for w in [2, 4, 5]:
+                digits = wnaf(n, w)
+                self.assertEqual(
+                    sum(d << i for i, d in enumerate(digits)), n)
+                for i, d in enumerate(digits):
+                    if d:
+                        self.assertTrue(d & 1 and abs(d) < 1 << (w - 1))
+                        self.assertFalse(any(digits[i + 1:i + w]))
+
+    def test_mul(self):
+        def mul_reference(ps):
+            # Plain double-and-add
+            r = (0, 1, 0)
+            for i in range(255, -1, -1):
+                r = SECP256K1.double(r)
+                for (p, n) in ps:
+                    if ((n >> i) & 1):
+                        r = SECP256K1.add(r, p)
+            return SECP256K1.affine(r)
+
+        P = SECP256K1.mul([(SECP256K1_G, random.randrange(SECP256K1_ORDER))])
+        affine_P = SECP256K1.affine(P)
+        scalars = [1, 2, 3, 16, 2**255, SECP256K1_ORDER - 1,
+                   random.randrange(SECP256K1_ORDER)]
+        for n in scalars:
+            # Fixed base, variable base in Jacobian and affine form
+            for p in [SECP256K1_G, P, affine_P]:
+                self.assertEqual(SECP256K1.affine(SECP256K1.mul([(p, n)])),
+                                 mul_reference([(p, n)]))
+            ps = [(SECP256K1_G, n), (P, SECP256K1_ORDER - n), (affine_P, 7)]
+            self.assertEqual(SECP256K1.affine(SECP256K1.mul(ps)),
+                             mul_reference(ps))
+
+        self.assertIsNone(SECP256K1.affine(
+            SECP256K1.mul([(SECP256K1_G, SECP256K1_ORDER)])))
+        self.assertIsNone(SECP256K1.affine(
+            SECP256K1.mul([(P, SECP256K1_ORDER)])))
+        self.assertIsNone(SECP256K1.affine(SECP256K1.mul([(P, 0)])))
+        self.assertIsNone(SECP256K1.affine(
+            SECP256K1.mul([(P, 1), (SECP256K1.negate(P), 1)])))
+        with self.assertRaises(AssertionError):
+            SECP256K1.mul([(P, -1)])
+        with self.assertRaises(AssertionError):
+            SECP256K1.mul([(SECP256K1_G, -1)])
+
+    def test_sign_verify(self):
+        key = ECKey()
+        key.generate()
+        pubkey = key.get_pubkey()
+        msg = hashlib.sha256(b'message').digest()
+        self.assertTrue(pubkey.verify_ecdsa(key.sign_ecdsa(msg), msg))
+        sig = key.sign_schnorr(msg)
+        self.assertTrue(pubkey.verify_schnorr(sig, msg))
+        self.assertFalse(pubkey.verify_schnorr(sig, bytes(32)))
+
+    @unittest.skipUnless(os.getenv("LIBSECP256K1"),
+                         "LIBSECP256K1 is not set")
+    def test_native_backend(self):
+        path = os.getenv("LIBSECP256K1")
+        previous = get_native_backend()
+
+        def both_backends(func):
+            # Run func with the Python, then the native implementation
+            try:
+                set_native_backend(None)
+                python_result = func()
+                self.assertTrue(set_native_backend(path))
+                return python_result, func()
+            finally:
+                set_native_backend(path if previous else None)
+
+        msg = hashlib.sha256(b'message').digest()
+        tweak = hashlib.sha256(b'tweak').digest()
+        for compressed in [True, False]:
+            key = ECKey()
+            key.generate(compressed)
+            pubkey = key.get_pubkey()
+            python_pubkey, native_pubkey = both_backends(key.get_pubkey)
+            self.assertEqual(python_pubkey.get_bytes(),
+                             native_pubkey.get_bytes())
+            python_tweaked, native_tweaked = both_backends(
+                lambda: pubkey.add(tweak))
+            self.assertEqual(python_tweaked.get_bytes(),
+                             native_tweaked.get_bytes())
+
+            # Each backend verifies the signatures of the other one
+            python_sig, native_sig = both_backends(
+                lambda: key.sign_ecdsa(msg))
+            for sig in [python_sig, native_sig]:
+                self.assertEqual(
+                    both_backends(lambda: pubkey.verify_ecdsa(sig, msg)),
+                    (True, True))
+                self.assertEqual(
+                    both_backends(lambda: pubkey.verify_ecdsa(sig, tweak)),
+                    (False, False))
+            high_s_sig = key.sign_ecdsa(msg, low_s=False)
+            self.assertEqual(
+                both_backends(
+                    lambda: pubkey.verify_ecdsa(high_s_sig, msg, low_s=False)),
+                (True, True))
+
+            python_sig, native_sig = both_backends(
+                lambda: key.sign_schnorr(msg))
+            for sig in [python_sig, native_sig]:
+                self.assertEqual(
+                    both_backends(lambda: pubkey.verify_schnorr(sig, msg)),
+                    (True, True))
+                self.assertEqual(
+                    both_backends(lambda: pubkey.verify_schnorr(sig, tweak)),
+                    (False, False))
+
+    def test_verify_schnorr_batch(self):
+        items = []
+        for i in range(10):
+            key = ECKey()
+            key.generate()
+            msg = hashlib.sha256(bytes([i])).digest()
+            items.append((key.get_pubkey(), key.sign_schnorr(msg), msg))
+        self.assertEqual(verify_schnorr_batch(items), [True] * 10)
+        self.assertEqual(verify_schnorr_batch(items[:1]), [True])
+        self.assertEqual(verify_schnorr_batch([]), [])
+
+        # Wrong message, R not on the curve, swapped s values and R >= p
+        pubkey, sig, msg = items[2]
+        items[2] = (pubkey, sig, bytes(32))
+        pubkey, sig, msg = items[4]
+        r = int.from_bytes(sig[:32], 'big')
+        while SECP256K1.is_x_coord(r):
+            r += 1
+        items[4] = (pubkey, r.to_bytes(32, 'big') + sig[32:], msg)
+        (pubkey5, sig5, msg5), (pubkey6, sig6, msg6) = items[5:7]
+        items[5] = (pubkey5, sig5[:32] + sig6[32:], msg5)
+        items[6] = (pubkey6, sig6[:32] + sig5[32:], msg6)
+        items[9] = (items[9][0], b'\xff' * 32 + items[9][1][32:], items[9][2])
+        expected = [i not in (2, 4, 5, 6, 9) for i in range(10)]
+        self.assertEqual(verify_schnorr_batch(items), expected)
+        self.assertEqual(
+            [pubkey.verify_schnorr(sig, msg) for pubkey, sig, msg in items],
+            expected)
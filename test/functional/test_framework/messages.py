@@ -67,6 +67,8 @@ MSG_TYPE_MASK = 0xffffffff >> 2
 
 FILTER_TYPE_BASIC = 0
 
+UINT256_MASK = (1 << 256) - 1
+
 # Serialization/deserialization tools
 
 
@@ -91,7 +93,68 @@ def ser_compact_size(size):
     return r
 
 
+class BufferReader:
+    """Cursor over a memoryview of serialized data.
+
+    This is a drop-in replacement for BytesIO as the stream argument of the
+    deserialize() methods: read() has the same semantics, but the underlying
+    buffer is never copied and the current position is a plain offset. The
+    deser_* helpers recognize it and decode fixed-size fields in place.
+    """
+    __slots__ = ("buf", "offset")
+
+    def __init__(self, data, offset=0):
+        self.buf = memoryview(data).cast("B")
+        self.offset = offset
+
+    def read(self, n=-1):
+        start = self.offset
+        end = len(self.buf) if n < 0 else min(start + n, len(self.buf))
+        self.offset = end
+        return self.buf[start:end].tobytes()
+
+    def view(self, n):
+        """Return the next n bytes as a memoryview, without copying them."""
+        start = self.offset
+        end = start + n
+        if end > len(self.buf):
+            raise struct.error(
+                "unpack requires a buffer of {} bytes".format(n))
+        self.offset = end
+        return self.buf[start:end]
+
+    def unpack(self, st):
+        """Decode the next st.size bytes in place using a struct.Struct."""
+        r = st.unpack_from(self.buf, self.offset)
+        self.offset += st.size
+        return r
+
+    def tell(self):
+        return self.offset
+
+    def seek(self, offset):
+        self.offset = offset
+
+    def remaining(self):
+        return len(self.buf) - self.offset
+
+
+_UINT8 = struct.Struct("<B")
+_UINT16 = struct.Struct("<H")
+_UINT32 = struct.Struct("<I")
+_UINT64 = struct.Struct("<Q")
+
+
 def deser_compact_size(f):
+    if isinstance(f, BufferReader):
+        nit = f.unpack(_UINT8)[0]
+        if nit == 253:
+            nit = f.unpack(_UINT16)[0]
+        elif nit == 254:
+            nit = f.unpack(_UINT32)[0]
+        elif nit == 255:
+            nit = f.unpack(_UINT64)[0]
+        return nit
     nit = struct.unpack("<B", f.read(1))[0]
     if nit == 253:
         nit = struct.unpack("<H", f.read(2))[0]
@@ -111,28 +174,25 @@ def ser_string(s):
     return ser_compact_size(len(s)) + s
 
 
+def ser_string_into(r, s):
+    r += ser_compact_size(len(s))
+    r += s
+
+
 def deser_uint256(f):
-    r = 0
-    for i in range(8):
-        t = struct.unpack("<I", f.read(4))[0]
-        r += t << (i * 32)
-    return r
+    if isinstance(f, BufferReader):
+        return int.from_bytes(f.view(32), 'little')
+    return uint256_from_str(f.read(32))
 
 
 def ser_uint256(u):
-    rs = b""
-    for _ in range(8):
-        rs += struct.pack("<I", u & 0xFFFFFFFF)
-        u >>= 32
-    return rs
+    return (u & UINT256_MASK).to_bytes(32, 'little')
 
 
 def uint256_from_str(s):
-    r = 0
-    t = struct.unpack("<IIIIIIII", s[:32])
-    for i in range(8):
-        r += t[i] << (i * 32)
-    return r
+    if len(s) < 32:
+        raise struct.error("unpack requires a buffer of 32 bytes")
+    return int.from_bytes(s[:32], 'little')
 
 
 def uint256_from_compact(c):
@@ -159,29 +219,40 @@ def deser_vector(f, c, deser_function_name=None):
 # ser_function_name: Allow for an alternate serialization function on the
 # entries in the vector.
 def ser_vector(v, ser_function_name=None):
-    r = ser_compact_size(len(v))
-    for i in v:
-        if ser_function_name:
+    r = bytearray()
+    ser_vector_into(r, v, ser_function_name)
+    return bytes(r)
+
+
+# Append the serialized vector to the bytearray r, so that nested objects are
+# written in a single pass instead of being concatenated level by level.
+def ser_vector_into(r, v, ser_function_name=None):
+    r += ser_compact_size(len(v))
+    if ser_function_name:
+        for i in v:
             r += getattr(i, ser_function_name)()
-        else:
-            r += i.serialize()
-    return r
+    else:
+        for i in v:
+            i.serialize_into(r)
 
 
 def deser_uint256_vector(f):
     nit = deser_compact_size(f)
-    r = []
-    for _ in range(nit):
-        t = deser_uint256(f)
-        r.append(t)
-    return r
+    # Read the whole vector at once and convert it in place
+    if isinstance(f, BufferReader):
+        buf = f.view(32 * nit)
+    else:
+        buf = memoryview(f.read(32 * nit))
+        if len(buf) != 32 * nit:
+            raise struct.error(
+                "unpack requires a buffer of {} bytes".format(32 * nit))
+    return [int.from_bytes(buf[i:i + 32], 'little')
+            for i in range(0, 32 * nit, 32)]
 
 
 def ser_uint256_vector(v):
-    r = ser_compact_size(len(v))
-    for i in v:
-        r += ser_uint256(i)
-    return r
+    return ser_compact_size(len(v)) + b"".join(
+        [(i & UINT256_MASK).to_bytes(32, 'little') for i in v])
 
 
 def deser_string_vector(f):
@@ -194,15 +265,15 @@ def deser_string_vector(f):
 
 
 def ser_string_vector(v):
-    r = ser_compact_size(len(v))
+    r = bytearray(ser_compact_size(len(v)))
     for sv in v:
-        r += ser_string(sv)
-    return r
+        ser_string_into(r, sv)
+    return bytes(r)
 
 
 def FromHex(obj, hex_string):
     """Deserialize from a hex string representation (eg from RPC)"""
-    obj.deserialize(BytesIO(hex_str_to_bytes(hex_string)))
+    obj.deserialize(BufferReader(hex_str_to_bytes(hex_string)))
     return obj
 
 
@@ -212,22 +283,119 @@ def ToHex(obj):
     return obj.serialize().hex()
 
 
+def _merkle_parent(left, right):
+    return hashlib.sha256(hashlib.sha256(left + right).digest()).digest()
+
+
+def _merkle_layer(layer):
+    """Hash a whole merkle layer, given as the concatenation of its 32-byte
+    hashes, into the next one.
+
+    The pairs are hashed straight out of the contiguous buffer, with the
+    odd trailing hash paired with a null hash, without building the
+    intermediate concatenations."""
+    if len(layer) % 64:
+        layer += bytes(32)
+    view = memoryview(layer)
+    return b"".join([
+        hashlib.sha256(hashlib.sha256(view[i:i + 64]).digest()).digest()
+        for i in range(0, len(layer), 64)
+    ])
+
+
 # Calculate merkle root given a vector of hashes
 def get_merkle_root(hashes):
     if not hashes:
         return bytes(32), 0
     num_layers = 1
-    while len(hashes) > 1:
+    layer = b"".join(hashes)
+    while len(layer) > 32:
         num_layers += 1
-        newhashes = []
-        for i in range(0, len(hashes), 2):
-            if i + 1 < len(hashes):
-                other = hashes[i + 1]
+        layer = _merkle_layer(layer)
+    return layer, num_layers
+
+
+class MerkleTree:
+    """Lotus merkle tree over 32-byte leaf hashes.
+
+    All the intermediate layers are kept, so that appending or replacing a
+    leaf only rehashes the O(log n) nodes on its path to the root. Removing
+    a leaf rehashes the nodes covering the leaves after it, so popping the
+    last leaf is O(log n) as well. root() returns the same
+    (root, num_layers) pair as get_merkle_root.
+    """
+    __slots__ = ("layers",)
+
+    def __init__(self, hashes=None):
+        self.layers = [list(hashes or [])]
+        layer = b"".join(self.layers[0])
+        while len(layer) > 32:
+            layer = _merkle_layer(layer)
+            self.layers.append(
+                [layer[i:i + 32] for i in range(0, len(layer), 32)])
+
+    def __len__(self):
+        return len(self.layers[0])
+
+    def __getitem__(self, index):
+        return self.layers[0][index]
+
+    def __setitem__(self, index, leaf_hash):
+        if index < 0:
+            index += len(self)
+        self.layers[0][index] = leaf_hash
+        self._update_path(index)
+
+    def append(self, leaf_hash):
+        self.layers[0].append(leaf_hash)
+        self._update_path(len(self) - 1)
+
+    def pop(self, index=-1):
+        if index < 0:
+            index += len(self)
+        leaf_hash = self.layers[0].pop(index)
+        self._rehash_from(index)
+        return leaf_hash
+
+    def root(self):
+        if not self.layers[0]:
+            return bytes(32), 0
+        return self.layers[-1][0], len(self.layers)
+
+    def _update_path(self, index):
+        """Recompute the parents of the node at the given index of the leaf
+        layer, adding a layer on top if the tree got taller."""
+        level = 0
+        while len(self.layers[level]) > 1:
+            layer = self.layers[level]
+            left = index & ~1
+            right = layer[left + 1] if left + 1 < len(layer) else bytes(32)
+            parent = _merkle_parent(layer[left], right)
+            index >>= 1
+            if level + 1 == len(self.layers):
+                self.layers.append([])
+            upper = self.layers[level + 1]
+            if index == len(upper):
+                upper.append(parent)
             else:
-                other = bytes(32)
-            newhashes.append(hash256(hashes[i] + other))
-        hashes = newhashes
-    return hashes[0], num_layers
+                upper[index] = parent
+            level += 1
+
+    def _rehash_from(self, index):
+        """Recompute all the nodes covering the leaves from the given index
+        onwards, and drop the layers the tree no longer needs."""
+        level = 0
+        while len(self.layers[level]) > 1:
+            layer = self.layers[level]
+            if level + 1 == len(self.layers):
+                self.layers.append([])
+            index >>= 1
+            upper = b"".join(layer[2 * index:])
+            upper = _merkle_layer(upper) if upper else b""
+            self.layers[level + 1][index:] = [
+                upper[i:i + 32] for i in range(0, len(upper), 32)]
+            level += 1
+        del self.layers[level + 1:]
 
 
 # Objects that map to lotusd objects, which can be serialized/deserialized
@@ -268,8 +436,12 @@ class CAddress:
 
     def serialize(self, *, with_time=True):
         """Serialize in addrv1 format (pre-BIP155)"""
+        r = bytearray()
+        self.serialize_into(r, with_time=with_time)
+        return bytes(r)
+
+    def serialize_into(self, r, *, with_time=True):
         assert self.net == self.NET_IPV4
-        r = b""
         if with_time:
             # VERSION messages serialize CAddress objects without time
             r += struct.pack("<I", self.time)
@@ -277,7 +449,6 @@ class CAddress:
         r += b"\x00" * 10 + b"\xff" * 2
         r += socket.inet_aton(self.ip)
         r += struct.pack(">H", self.port)
-        return r
 
     def deserialize_v2(self, f):
         """Deserialize from addrv2 format (BIP155)"""
@@ -297,15 +468,18 @@ class CAddress:
 
     def serialize_v2(self):
         """Serialize in addrv2 format (BIP155)"""
+        r = bytearray()
+        self.serialize_v2_into(r)
+        return bytes(r)
+
+    def serialize_v2_into(self, r):
         assert self.net == self.NET_IPV4
-        r = b""
         r += struct.pack("<I", self.time)
         r += ser_compact_size(self.nServices)
         r += struct.pack("B", self.net)
         r += ser_compact_size(self.ADDRV2_ADDRESS_LENGTH[self.net])
         r += socket.inet_aton(self.ip)
         r += struct.pack(">H", self.port)
-        return r
 
     def __repr__(self):
         return ("CAddress(nServices=%i net=%s addr=%s port=%i)"
@@ -333,10 +507,13 @@ class CInv:
         self.hash = deser_uint256(f)
 
     def serialize(self):
-        r = b""
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
         r += struct.pack("<i", self.type)
         r += ser_uint256(self.hash)
-        return r
 
     def __repr__(self):
         return "CInv(type={} hash={:064x})".format(
@@ -359,39 +536,61 @@ class CBlockLocator:
         self.vHave = deser_uint256_vector(f)
 
     def serialize(self):
-        r = b""
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
         # Bitcoin ABC ignores version field. Set it to 0.
         r += struct.pack("<i", 0)
         r += ser_uint256_vector(self.vHave)
-        return r
 
     def __repr__(self):
         return "CBlockLocator(vHave={})".format(repr(self.vHave))
 
 
+# COutPoint, CTxIn, CTxOut and CTransaction cache their serialization and
+# hashes. Each cache entry records the field values it was computed from and
+# is only reused while they are unchanged, so tests can keep mutating fields
+# (and the vin/vout lists) freely. Nested objects are compared through their
+# own cached serialization, which is the same bytes object as long as they
+# are unchanged. Fields are expected to hold immutable values (ints, bytes,
+# CScript).
+
 class COutPoint:
-    __slots__ = ("hash", "n")
+    __slots__ = ("hash", "n", "_cache")
 
     def __init__(self, hash=0, n=0):
         self.hash = hash
         self.n = n
+        self._cache = None
 
     def deserialize(self, f):
         self.hash = deser_uint256(f)
         self.n = struct.unpack("<I", f.read(4))[0]
 
     def serialize(self):
-        r = b""
-        r += ser_uint256(self.hash)
-        r += struct.pack("<I", self.n)
-        return r
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        r += self.get_cached_serialization()
+
+    def get_cached_serialization(self):
+        c = self._cache
+        if c is None or c[0] != self.hash or c[1] != self.n:
+            c = self._cache = (
+                self.hash, self.n,
+                ser_uint256(self.hash) + struct.pack("<I", self.n))
+        return c[2]
 
     def __repr__(self):
         return "COutPoint(hash={:064x} n={})".format(self.hash, self.n)
 
 
 class CTxIn:
-    __slots__ = ("nSequence", "prevout", "scriptSig")
+    __slots__ = ("nSequence", "prevout", "scriptSig", "_cache")
 
     def __init__(self, outpoint=None, scriptSig=b"", nSequence=0):
         if outpoint is None:
@@ -400,6 +599,7 @@ class CTxIn:
             self.prevout = outpoint
         self.scriptSig = scriptSig
         self.nSequence = nSequence
+        self._cache = None
 
     def deserialize(self, f):
         self.prevout = COutPoint()
@@ -408,11 +608,35 @@ class CTxIn:
         self.nSequence = struct.unpack("<I", f.read(4))[0]
 
     def serialize(self):
-        r = b""
-        r += self.prevout.serialize()
-        r += ser_string(self.scriptSig)
-        r += struct.pack("<I", self.nSequence)
-        return r
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        r += self.get_cached_serialization()
+
+    def _get_cache(self):
+        # [prevout, scriptSig, nSequence, serialization, leaf hash]
+        prevout = self.prevout.get_cached_serialization()
+        c = self._cache
+        if (c is None or c[0] != prevout or c[1] != self.scriptSig
+                or c[2] != self.nSequence):
+            r = bytearray(prevout)
+            ser_string_into(r, self.scriptSig)
+            r += struct.pack("<I", self.nSequence)
+            c = self._cache = [prevout, self.scriptSig, self.nSequence,
+                               bytes(r), None]
+        return c
+
+    def get_cached_serialization(self):
+        return self._get_cache()[3]
+
+    def get_leaf_hash(self):
+        """Hash of this input as a leaf of the txid input merkle tree"""
+        c = self._get_cache()
+        if c[4] is None:
+            c[4] = hash256(c[0] + struct.pack("<I", c[2]))
+        return c[4]
 
     def __repr__(self):
         return "CTxIn(prevout={} scriptSig={} nSequence={})".format(
@@ -420,21 +644,44 @@ class CTxIn:
 
 
 class CTxOut:
-    __slots__ = ("nValue", "scriptPubKey")
+    __slots__ = ("nValue", "scriptPubKey", "_cache")
 
     def __init__(self, nValue=0, scriptPubKey=b""):
         self.nValue = nValue
         self.scriptPubKey = scriptPubKey
+        self._cache = None
 
     def deserialize(self, f):
         self.nValue = struct.unpack("<q", f.read(8))[0]
         self.scriptPubKey = deser_string(f)
 
     def serialize(self):
-        r = b""
-        r += struct.pack("<q", self.nValue)
-        r += ser_string(self.scriptPubKey)
-        return r
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        r += self.get_cached_serialization()
+
+    def _get_cache(self):
+        # [nValue, scriptPubKey, serialization, leaf hash]
+        c = self._cache
+        if (c is None or c[0] != self.nValue
+                or c[1] != self.scriptPubKey):
+            r = bytearray(struct.pack("<q", self.nValue))
+            ser_string_into(r, self.scriptPubKey)
+            c = self._cache = [self.nValue, self.scriptPubKey, bytes(r), None]
+        return c
+
+    def get_cached_serialization(self):
+        return self._get_cache()[2]
+
+    def get_leaf_hash(self):
+        """Hash of this output as a leaf of the txid output merkle tree"""
+        c = self._get_cache()
+        if c[3] is None:
+            c[3] = hash256(c[2])
+        return c[3]
 
     def __repr__(self):
         return "CTxOut(nValue={}.{:06d} scriptPubKey={})".format(
@@ -451,6 +698,7 @@ class CTransaction:
         "nVersion",
         "vin",
         "vout",
+        "_cache",
     )
 
     def __init__(self, tx=None):
@@ -463,6 +711,7 @@ class CTransaction:
             self.txhash_hex = None
             self.txid = None
             self.txid_hex = None
+            self._cache = None
         else:
             self.nVersion = tx.nVersion
             self.vin = copy.deepcopy(tx.vin)
@@ -472,6 +721,9 @@ class CTransaction:
             self.txhash_hex = tx.txhash_hex
             self.txid = tx.txid
             self.txid_hex = tx.txid_hex
+            # Cache entries are never modified once their inputs differ, so
+            # they can be shared with the copy.
+            self._cache = tx._cache
 
     def deserialize(self, f):
         self.nVersion = struct.unpack("<i", f.read(4))[0]
@@ -482,6 +734,7 @@ class CTransaction:
         self.txhash_hex = None
         self.txid = None
         self.txid_hex = None
+        self._cache = None
 
     def billable_size(self):
         """
@@ -490,12 +743,35 @@ class CTransaction:
         return len(self.serialize())
 
     def serialize(self):
-        r = b""
-        r += struct.pack("<i", self.nVersion)
-        r += ser_vector(self.vin)
-        r += ser_vector(self.vout)
-        r += struct.pack("<I", self.nLockTime)
-        return r
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        r += self._get_cache()[4]
+
+    def _get_cache(self):
+        # [nVersion, nLockTime, vin serializations, vout serializations,
+        #  serialization, txhash bytes, txid bytes, block merkle leaf hash]
+        vin = [tx_input.get_cached_serialization() for tx_input in self.vin]
+        vout = [tx_output.get_cached_serialization()
+                for tx_output in self.vout]
+        c = self._cache
+        # Lists compare their items by identity first, so this is cheap when
+        # nothing changed.
+        if (c is None or c[0] != self.nVersion or c[1] != self.nLockTime
+                or c[2] != vin or c[3] != vout):
+            r = bytearray(struct.pack("<i", self.nVersion))
+            r += ser_compact_size(len(vin))
+            for tx_input in vin:
+                r += tx_input
+            r += ser_compact_size(len(vout))
+            for tx_output in vout:
+                r += tx_output
+            r += struct.pack("<I", self.nLockTime)
+            c = self._cache = [self.nVersion, self.nLockTime, vin, vout,
+                               bytes(r), None, None, None]
+        return c
 
     # Recalculate the txid
     def rehash(self):
@@ -503,40 +779,53 @@ class CTransaction:
         self.calc_txid()
 
     def calc_txhash(self):
-        txhash_bytes = hash256(self.serialize())
+        txhash_bytes = self._get_txhash_bytes()
         self.txhash_hex = txhash_bytes[::-1].hex()
         self.txhash = uint256_from_str(txhash_bytes)
 
     def calc_txid(self):
-        r = bytearray()
-        r += self.nVersion.to_bytes(4, 'little')
-        input_merkle_root, num_layers = self.input_merkle_root()
-        r += input_merkle_root
-        r += num_layers.to_bytes(1, 'little')
-        output_merkle_root, num_layers = self.output_merkle_root()
-        r += output_merkle_root
-        r += num_layers.to_bytes(1, 'little')
-        r += self.nLockTime.to_bytes(4, 'little')
-        txid_bytes = hash256(r)
+        txid_bytes = self._get_txid_bytes()
         self.txid_hex = txid_bytes[::-1].hex()
         self.txid = uint256_from_str(txid_bytes)
-    
+
+    def _get_txhash_bytes(self):
+        c = self._get_cache()
+        if c[5] is None:
+            c[5] = hash256(c[4])
+        return c[5]
+
+    def _get_txid_bytes(self):
+        c = self._get_cache()
+        if c[6] is None:
+            r = bytearray()
+            r += self.nVersion.to_bytes(4, 'little')
+            input_merkle_root, num_layers = self.input_merkle_root()
+            r += input_merkle_root
+            r += num_layers.to_bytes(1, 'little')
+            output_merkle_root, num_layers = self.output_merkle_root()
+            r += output_merkle_root
+            r += num_layers.to_bytes(1, 'little')
+            r += self.nLockTime.to_bytes(4, 'little')
+            c[6] = hash256(r)
+        return c[6]
+
+    def get_block_leaf_hash(self):
+        """Hash of this transaction as a leaf of the block merkle tree, i.e.
+        hash256(txhash || txid)."""
+        c = self._get_cache()
+        if c[7] is None:
+            c[7] = hash256(self._get_txhash_bytes() + self._get_txid_bytes())
+        return c[7]
+
     def is_coinbase(self):
         return self.vin[0].prevout.hash == 0
 
     def input_merkle_root(self):
-        hashes = []
-        for tx_input in self.vin:
-            tx_input_ser = bytearray()
-            tx_input_ser += tx_input.prevout.serialize()
-            tx_input_ser += tx_input.nSequence.to_bytes(4, 'little')
-            hashes.append(hash256(tx_input_ser))
+        hashes = [tx_input.get_leaf_hash() for tx_input in self.vin]
         return get_merkle_root(hashes)
 
     def output_merkle_root(self):
-        hashes = []
-        for tx_output in self.vout:
-            hashes.append(hash256(tx_output.serialize()))
+        hashes = [tx_output.get_leaf_hash() for tx_output in self.vout]
         return get_merkle_root(hashes)
 
     def get_id(self):
@@ -608,22 +897,34 @@ class CBlockHeader:
         self.hash = None
 
     def deserialize(self, f):
-        self.hashPrevBlock = deser_uint256(f)
-        self.nBits = int.from_bytes(f.read(4), 'little')
-        self.nTime = int.from_bytes(f.read(6), 'little')
-        self.nReserved = int.from_bytes(f.read(2), 'little')
-        self.nNonce = int.from_bytes(f.read(8), 'little')
-        self.nHeaderVersion = int.from_bytes(f.read(1), 'little')
-        self.nSize = int.from_bytes(f.read(7), 'little')
-        self.nHeight = int.from_bytes(f.read(4), 'little')
-        self.hashEpochBlock = deser_uint256(f)
-        self.hashMerkleRoot = deser_uint256(f)
-        self.hashExtendedMetadata = deser_uint256(f)
+        # Read the fixed size header at once and decode the fields from it
+        if isinstance(f, BufferReader):
+            h = f.view(160)
+        else:
+            h = memoryview(f.read(160))
+            if len(h) != 160:
+                raise struct.error("unpack requires a buffer of 160 bytes")
+        self.hashPrevBlock = int.from_bytes(h[0:32], 'little')
+        self.nBits = int.from_bytes(h[32:36], 'little')
+        self.nTime = int.from_bytes(h[36:42], 'little')
+        self.nReserved = int.from_bytes(h[42:44], 'little')
+        self.nNonce = int.from_bytes(h[44:52], 'little')
+        self.nHeaderVersion = h[52]
+        self.nSize = int.from_bytes(h[53:60], 'little')
+        self.nHeight = int.from_bytes(h[60:64], 'little')
+        self.hashEpochBlock = int.from_bytes(h[64:96], 'little')
+        self.hashMerkleRoot = int.from_bytes(h[96:128], 'little')
+        self.hashExtendedMetadata = int.from_bytes(h[128:160], 'little')
         self.sha256 = None
         self.hash = None
 
     def serialize(self):
         r = bytearray()
+        # Only the header, even when called on a CBlock
+        CBlockHeader.serialize_into(self, r)
+        return bytes(r)
+
+    def serialize_into(self, r):
         r += ser_uint256(self.hashPrevBlock)
         r += self.nBits.to_bytes(4, 'little')
         r += self.nTime.to_bytes(6, 'little')
@@ -635,7 +936,6 @@ class CBlockHeader:
         r += ser_uint256(self.hashEpochBlock)
         r += ser_uint256(self.hashMerkleRoot)
         r += ser_uint256(self.hashExtendedMetadata)
-        return bytes(r)
 
     def calc_sha256(self):
         if self.sha256 is None:
@@ -696,11 +996,14 @@ class CBlock(CBlockHeader):
         self.vtx = deser_vector(f, CTransaction)
 
     def serialize(self):
-        r = b""
-        r += super().serialize()
-        r += ser_vector(self.vMetadata)
-        r += ser_vector(self.vtx)
-        return r
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        super().serialize_into(r)
+        ser_vector_into(r, self.vMetadata)
+        ser_vector_into(r, self.vtx)
 
     def update_size(self):
         self.nSize = len(self.serialize())
@@ -713,7 +1016,7 @@ class CBlock(CBlockHeader):
         hashes = []
         for tx in self.vtx:
             tx.rehash()
-            hashes.append(hash256(ser_uint256(tx.txhash) + ser_uint256(tx.txid)))
+            hashes.append(tx.get_block_leaf_hash())
         return uint256_from_str(get_merkle_root(hashes)[0])
 
     def is_valid(self):
@@ -744,7 +1047,7 @@ class CBlock(CBlockHeader):
 class CBlockMetadataField:
     __slots__ = ("fieldId", "data")
 
-    def __init__(self, fieldId, data):
+    def __init__(self, fieldId=0, data=b""):
         self.fieldId = fieldId
         self.data = data
 
@@ -754,9 +1057,12 @@ class CBlockMetadataField:
 
     def serialize(self):
         r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
         r += self.fieldId.to_bytes(4, 'little')
-        r += ser_string(self.data)
-        return r
+        ser_string_into(r, self.data)
 
 
 class PrefilledTransaction:
@@ -772,10 +1078,13 @@ class PrefilledTransaction:
         self.tx.deserialize(f)
 
     def serialize(self):
-        r = b""
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
         r += ser_compact_size(self.index)
-        r += self.tx.serialize()
-        return r
+        self.tx.serialize_into(r)
 
     def __repr__(self):
         return "PrefilledTransaction(index={}, tx={})".format(
@@ -802,24 +1111,25 @@ class P2PHeaderAndShortIDs:
         self.nonce = struct.unpack("<Q", f.read(8))[0]
         self.shortids_length = deser_compact_size(f)
         for _ in range(self.shortids_length):
-            # shortids are defined to be 6 bytes in the spec, so append
-            # two zero bytes and read it in as an 8-byte number
-            self.shortids.append(
-                struct.unpack("<Q", f.read(6) + b'\x00\x00')[0])
+            # shortids are defined to be 6 bytes in the spec
+            self.shortids.append(int.from_bytes(f.read(6), 'little'))
         self.prefilled_txn = deser_vector(f, PrefilledTransaction)
         self.prefilled_txn_length = len(self.prefilled_txn)
 
     def serialize(self):
-        r = b""
-        r += self.header.serialize()
-        r += ser_vector(self.vMetadata)
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        self.header.serialize_into(r)
+        ser_vector_into(r, self.vMetadata)
         r += struct.pack("<Q", self.nonce)
         r += ser_compact_size(self.shortids_length)
         for x in self.shortids:
             # We only want the first 6 bytes
             r += struct.pack("<Q", x)[0:6]
-        r += ser_vector(self.prefilled_txn)
-        return r
+        ser_vector_into(r, self.prefilled_txn)
 
     def __repr__(self):
         return "P2PHeaderAndShortIDs(header={}, vMetadata={}, nonce={}, shortids_length={}, shortids={}, prefilled_txn_length={}, prefilledtxn={}".format(
@@ -915,12 +1225,15 @@ class BlockTransactionsRequest:
             self.indexes.append(deser_compact_size(f))
 
     def serialize(self):
-        r = b""
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
         r += ser_uint256(self.blockhash)
         r += ser_compact_size(len(self.indexes))
         for x in self.indexes:
             r += ser_compact_size(x)
-        return r
 
     # helper to set the differentially encoded indexes from absolute ones
     def from_absolute(self, absolute_indexes):
@@ -955,10 +1268,13 @@ class BlockTransactions:
         self.transactions = deser_vector(f, CTransaction)
 
     def serialize(self):
-        r = b""
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
         r += ser_uint256(self.blockhash)
-        r += ser_vector(self.transactions)
-        return r
+        ser_vector_into(r, self.transactions)
 
     def __repr__(self):
         return "BlockTransactions(hash={:064x} transactions={})".format(
@@ -988,13 +1304,17 @@ class AvalancheStake:
         self.pubkey = deser_string(f)
 
     def serialize(self) -> bytes:
-        r = self.utxo.serialize()
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        self.utxo.serialize_into(r)
         height_ser = self.height << 1 | int(self.is_coinbase)
         r += struct.pack('<q', self.amount)
         r += struct.pack('<I', height_ser)
         r += ser_compact_size(len(self.pubkey))
         r += self.pubkey
-        return r
 
     def __repr__(self):
         return f"AvalancheStake(utxo={self.utxo}, amount={self.amount}," \
@@ -1014,7 +1334,13 @@ class AvalancheSignedStake:
         self.sig = f.read(64)
 
     def serialize(self) -> bytes:
-        return self.stake.serialize() + self.sig
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        self.stake.serialize_into(r)
+        r += self.sig
 
 
 class AvalancheProof:
@@ -1048,12 +1374,12 @@ class AvalancheProof:
         """Compute Bitcoin's 256-bit hash (double SHA-256) of the
         serialized proof data.
         """
-        ss = struct.pack("<Qq", self.sequence, self.expiration)
-        ss += ser_string(self.payout_script)
+        ss = bytearray(struct.pack("<Qq", self.sequence, self.expiration))
+        ser_string_into(ss, self.payout_script)
         ss += ser_compact_size(len(self.stakes))
         # Use unsigned stakes
         for s in self.stakes:
-            ss += s.stake.serialize()
+            s.stake.serialize_into(ss)
         h = hash256(ss)
         self.limited_proofid = uint256_from_str(h)
         h += ser_string(self.master)
@@ -1071,14 +1397,17 @@ class AvalancheProof:
         self.compute_proof_id()
 
     def serialize(self):
-        r = b""
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
         r += struct.pack("<Q", self.sequence)
         r += struct.pack("<q", self.expiration)
-        r += ser_string(self.master)
-        r += ser_vector(self.stakes)
-        r += ser_string(self.payout_script)
+        ser_string_into(r, self.master)
+        ser_vector_into(r, self.stakes)
+        ser_string_into(r, self.payout_script)
         r += self.signature
-        return r
 
     def __repr__(self):
         return f"AvalancheProof(sequence={self.sequence}, " \
@@ -1098,11 +1427,11 @@ class LegacyAvalancheProof(AvalancheProof):
         """Compute Bitcoin's 256-bit hash (double SHA-256) of the
         serialized proof data.
         """
-        ss = struct.pack("<Qq", self.sequence, self.expiration)
+        ss = bytearray(struct.pack("<Qq", self.sequence, self.expiration))
         ss += ser_compact_size(len(self.stakes))
         # Use unsigned stakes
         for s in self.stakes:
-            ss += s.stake.serialize()
+            s.stake.serialize_into(ss)
         h = hash256(ss)
         self.limited_proofid = uint256_from_str(h)
         h += ser_string(self.master)
@@ -1118,12 +1447,15 @@ class LegacyAvalancheProof(AvalancheProof):
         self.compute_proof_id()
 
     def serialize(self):
-        r = b""
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
         r += struct.pack("<Q", self.sequence)
         r += struct.pack("<q", self.expiration)
-        r += ser_string(self.master)
-        r += ser_vector(self.stakes)
-        return r
+        ser_string_into(r, self.master)
+        ser_vector_into(r, self.stakes)
 
     def __repr__(self):
         return f"LegacyAvalancheProof(sequence={self.sequence}, " \
@@ -1144,10 +1476,13 @@ class AvalanchePoll():
         self.invs = deser_vector(f, CInv)
 
     def serialize(self):
-        r = b""
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
         r += struct.pack("<q", self.round)
-        r += ser_vector(self.invs)
-        return r
+        ser_vector_into(r, self.invs)
 
     def __repr__(self):
         return "AvalanchePoll(round={}, invs={})".format(
@@ -1176,10 +1511,13 @@ class AvalancheVote():
         self.hash = deser_uint256(f)
 
     def serialize(self):
-        r = b""
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
         r += struct.pack("<i", self.error)
         r += ser_uint256(self.hash)
-        return r
 
     def __repr__(self):
         return "AvalancheVote(error={}, hash={:064x})".format(
@@ -1200,11 +1538,14 @@ class AvalancheResponse():
         self.votes = deser_vector(f, AvalancheVote)
 
     def serialize(self):
-        r = b""
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
         r += struct.pack("<q", self.round)
         r += struct.pack("<i", self.cooldown)
-        r += ser_vector(self.votes)
-        return r
+        ser_vector_into(r, self.votes)
 
     def get_hash(self):
         return hash256(self.serialize())
@@ -1226,10 +1567,13 @@ class TCPAvalancheResponse():
         self.sig = f.read(64)
 
     def serialize(self):
-        r = b""
-        r += self.response.serialize()
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        self.response.serialize_into(r)
         r += self.sig
-        return r
 
     def __repr__(self):
         return "TCPAvalancheResponse(response={}, sig={})".format(
@@ -1248,10 +1592,13 @@ class AvalancheDelegationLevel:
         self.sig = f.read(64)
 
     def serialize(self):
-        r = b""
-        r += ser_string(self.pubkey)
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        ser_string_into(r, self.pubkey)
         r += self.sig
-        return r
 
     def __repr__(self):
         return "AvalancheDelegationLevel(pubkey={}, sig={})".format(
@@ -1280,11 +1627,14 @@ class AvalancheDelegation:
         self.proofid = self.compute_proofid()
 
     def serialize(self):
-        r = b""
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
         r += ser_uint256(self.limited_proofid)
-        r += ser_string(self.proof_master)
-        r += ser_vector(self.levels)
-        return r
+        ser_string_into(r, self.proof_master)
+        ser_vector_into(r, self.levels)
 
     def __repr__(self):
         return f"AvalancheDelegation(limitedProofId={self.limited_proofid:064x}, " \
@@ -1310,10 +1660,13 @@ class AvalancheHello():
         self.sig = f.read(64)
 
     def serialize(self):
-        r = b""
-        r += self.delegation.serialize()
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        self.delegation.serialize_into(r)
         r += self.sig
-        return r
 
     def __repr__(self):
         return "AvalancheHello(delegation={}, sig={})".format(
@@ -1345,14 +1698,17 @@ class CPartialMerkleTree:
             self.vBits.append(vBytes[i // 8] & (1 << (i % 8)) != 0)
 
     def serialize(self):
-        r = b""
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
         r += struct.pack("<i", self.nTransactions)
         r += ser_uint256_vector(self.vHash)
         vBytesArray = bytearray([0x00] * ((len(self.vBits) + 7) // 8))
         for i in range(len(self.vBits)):
             vBytesArray[i // 8] |= self.vBits[i] << (i % 8)
-        r += ser_string(bytes(vBytesArray))
-        return r
+        ser_string_into(r, bytes(vBytesArray))
 
     def __repr__(self):
         return "CPartialMerkleTree(nTransactions={}, vHash={}, vBits={})".format(
@@ -1371,10 +1727,13 @@ class CMerkleBlock:
         self.txn.deserialize(f)
 
     def serialize(self):
-        r = b""
-        r += self.header.serialize()
-        r += self.txn.serialize()
-        return r
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        self.header.serialize_into(r)
+        self.txn.serialize_into(r)
 
     def __repr__(self):
         return "CMerkleBlock(header={}, txn={})".format(
@@ -1419,18 +1778,21 @@ class msg_version:
         self.nExtraEntropy = struct.unpack("<Q", f.read(8))[0]
 
     def serialize(self):
-        r = b""
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
         r += struct.pack("<i", self.nVersion)
         r += struct.pack("<Q", self.nServices)
         r += struct.pack("<q", self.nTime)
-        r += self.addrTo.serialize(with_time=False)
-        r += self.addrFrom.serialize(with_time=False)
+        self.addrTo.serialize_into(r, with_time=False)
+        self.addrFrom.serialize_into(r, with_time=False)
         r += struct.pack("<Q", self.nNonce)
-        r += ser_string(self.strSubVer.encode('utf-8'))
+        ser_string_into(r, self.strSubVer.encode('utf-8'))
         r += struct.pack("<i", self.nStartingHeight)
         r += struct.pack("<b", self.relay)
         r += struct.pack("<Q", self.nExtraEntropy)
-        return r
 
     def __repr__(self):
         return 'msg_version(nVersion={} nServices={} nTime={} addrTo={} addrFrom={} nNonce=0x{:016X} strSubVer={} nStartingHeight={} relay={} nExtraEntropy={})'.format(
@@ -1450,7 +1812,12 @@ class msg_verack:
         pass
 
     def serialize(self):
-        return b""
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        pass
 
     def __repr__(self):
         return "msg_verack()"
@@ -1467,7 +1834,12 @@ class msg_addr:
         self.addrs = deser_vector(f, CAddress)
 
     def serialize(self):
-        return ser_vector(self.addrs)
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        ser_vector_into(r, self.addrs)
 
     def __repr__(self):
         return "msg_addr(addrs={})".format(repr(self.addrs))
@@ -1484,7 +1856,12 @@ class msg_addrv2:
         self.addrs = deser_vector(f, CAddress, "deserialize_v2")
 
     def serialize(self):
-        return ser_vector(self.addrs, "serialize_v2")
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        ser_vector_into(r, self.addrs, "serialize_v2")
 
     def __repr__(self):
         return "msg_addrv2(addrs={})".format(repr(self.addrs))
@@ -1501,7 +1878,12 @@ class msg_sendaddrv2:
         pass
 
     def serialize(self):
-        return b""
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        pass
 
     def __repr__(self):
         return "msg_sendaddrv2()"
@@ -1521,7 +1903,12 @@ class msg_inv:
         self.inv = deser_vector(f, CInv)
 
     def serialize(self):
-        return ser_vector(self.inv)
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        ser_vector_into(r, self.inv)
 
     def __repr__(self):
         return "msg_inv(inv={})".format(repr(self.inv))
@@ -1538,7 +1925,12 @@ class msg_getdata:
         self.inv = deser_vector(f, CInv)
 
     def serialize(self):
-        return ser_vector(self.inv)
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        ser_vector_into(r, self.inv)
 
     def __repr__(self):
         return "msg_getdata(inv={})".format(repr(self.inv))
@@ -1558,10 +1950,13 @@ class msg_getblocks:
         self.hashstop = deser_uint256(f)
 
     def serialize(self):
-        r = b""
-        r += self.locator.serialize()
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        self.locator.serialize_into(r)
         r += ser_uint256(self.hashstop)
-        return r
 
     def __repr__(self):
         return "msg_getblocks(locator={} hashstop={:064x})".format(
@@ -1579,7 +1974,12 @@ class msg_tx:
         self.tx.deserialize(f)
 
     def serialize(self):
-        return self.tx.serialize()
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        self.tx.serialize_into(r)
 
     def __repr__(self):
         return "msg_tx(tx={})".format(repr(self.tx))
@@ -1599,7 +1999,12 @@ class msg_block:
         self.block.deserialize(f)
 
     def serialize(self):
-        return self.block.serialize()
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        self.block.serialize_into(r)
 
     def __repr__(self):
         return "msg_block(block={})".format(repr(self.block))
@@ -1617,6 +2022,9 @@ class msg_generic:
     def serialize(self):
         return self.data
 
+    def serialize_into(self, r):
+        r += self.data
+
     def __repr__(self):
         return "msg_generic()"
 
@@ -1632,7 +2040,12 @@ class msg_getaddr:
         pass
 
     def serialize(self):
-        return b""
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        pass
 
     def __repr__(self):
         return "msg_getaddr()"
@@ -1649,9 +2062,12 @@ class msg_ping:
         self.nonce = struct.unpack("<Q", f.read(8))[0]
 
     def serialize(self):
-        r = b""
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
         r += struct.pack("<Q", self.nonce)
-        return r
 
     def __repr__(self):
         return "msg_ping(nonce={:08x})".format(self.nonce)
@@ -1668,9 +2084,12 @@ class msg_pong:
         self.nonce = struct.unpack("<Q", f.read(8))[0]
 
     def serialize(self):
-        r = b""
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
         r += struct.pack("<Q", self.nonce)
-        return r
 
     def __repr__(self):
         return "msg_pong(nonce={:08x})".format(self.nonce)
@@ -1687,7 +2106,12 @@ class msg_mempool:
         pass
 
     def serialize(self):
-        return b""
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        pass
 
     def __repr__(self):
         return "msg_mempool()"
@@ -1704,7 +2128,12 @@ class msg_notfound:
         self.vec = deser_vector(f, CInv)
 
     def serialize(self):
-        return ser_vector(self.vec)
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        ser_vector_into(r, self.vec)
 
     def __repr__(self):
         return "msg_notfound(vec={})".format(repr(self.vec))
@@ -1721,7 +2150,12 @@ class msg_sendheaders:
         pass
 
     def serialize(self):
-        return b""
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        pass
 
     def __repr__(self):
         return "msg_sendheaders()"
@@ -1745,10 +2179,13 @@ class msg_getheaders:
         self.hashstop = deser_uint256(f)
 
     def serialize(self):
-        r = b""
-        r += self.locator.serialize()
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        self.locator.serialize_into(r)
         r += ser_uint256(self.hashstop)
-        return r
 
     def __repr__(self):
         return "msg_getheaders(locator={}, stop={:064x})".format(
@@ -1769,7 +2206,16 @@ class msg_headers:
         self.headers = deser_vector(f, CBlockHeader)
 
     def serialize(self):
-        return ser_vector([CBlockHeader(header) for header in self.headers])
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        r += ser_compact_size(len(self.headers))
+        for header in self.headers:
+            # Headers are sent without the block body, even if the entry is
+            # a full CBlock
+            CBlockHeader.serialize_into(header, r)
 
     def __repr__(self):
         return "msg_headers(headers={})".format(repr(self.headers))
@@ -1789,7 +2235,12 @@ class msg_merkleblock:
         self.merkleblock.deserialize(f)
 
     def serialize(self):
-        return self.merkleblock.serialize()
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        self.merkleblock.serialize_into(r)
 
     def __repr__(self):
         return "msg_merkleblock(merkleblock={})".format(repr(self.merkleblock))
@@ -1812,12 +2263,15 @@ class msg_filterload:
         self.nFlags = struct.unpack("<B", f.read(1))[0]
 
     def serialize(self):
-        r = b""
-        r += ser_string(self.data)
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        ser_string_into(r, self.data)
         r += struct.pack("<I", self.nHashFuncs)
         r += struct.pack("<I", self.nTweak)
         r += struct.pack("<B", self.nFlags)
-        return r
 
     def __repr__(self):
         return "msg_filterload(data={}, nHashFuncs={}, nTweak={}, nFlags={})".format(
@@ -1835,9 +2289,12 @@ class msg_filteradd:
         self.data = deser_string(f)
 
     def serialize(self):
-        r = b""
-        r += ser_string(self.data)
-        return r
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        ser_string_into(r, self.data)
 
     def __repr__(self):
         return "msg_filteradd(data={})".format(self.data)
@@ -1854,7 +2311,12 @@ class msg_filterclear:
         pass
 
     def serialize(self):
-        return b""
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        pass
 
     def __repr__(self):
         return "msg_filterclear()"
@@ -1871,9 +2333,12 @@ class msg_feefilter:
         self.feerate = struct.unpack("<Q", f.read(8))[0]
 
     def serialize(self):
-        r = b""
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
         r += struct.pack("<Q", self.feerate)
-        return r
 
     def __repr__(self):
         return "msg_feefilter(feerate={:08x})".format(self.feerate)
@@ -1892,10 +2357,13 @@ class msg_sendcmpct:
         self.version = struct.unpack("<Q", f.read(8))[0]
 
     def serialize(self):
-        r = b""
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
         r += struct.pack("<?", self.announce)
         r += struct.pack("<Q", self.version)
-        return r
 
     def __repr__(self):
         return "msg_sendcmpct(announce={}, version={})".format(
@@ -1914,9 +2382,12 @@ class msg_cmpctblock:
         self.header_and_shortids.deserialize(f)
 
     def serialize(self):
-        r = b""
-        r += self.header_and_shortids.serialize()
-        return r
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        self.header_and_shortids.serialize_into(r)
 
     def __repr__(self):
         return "msg_cmpctblock(HeaderAndShortIDs={})".format(
@@ -1935,9 +2406,12 @@ class msg_getblocktxn:
         self.block_txn_request.deserialize(f)
 
     def serialize(self):
-        r = b""
-        r += self.block_txn_request.serialize()
-        return r
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        self.block_txn_request.serialize_into(r)
 
     def __repr__(self):
         return "msg_getblocktxn(block_txn_request={})".format(
@@ -1955,9 +2429,12 @@ class msg_blocktxn:
         self.block_transactions.deserialize(f)
 
     def serialize(self):
-        r = b""
-        r += self.block_transactions.serialize()
-        return r
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        self.block_transactions.serialize_into(r)
 
     def __repr__(self):
         return "msg_blocktxn(block_transactions={})".format(
@@ -1979,11 +2456,14 @@ class msg_getcfilters:
         self.stop_hash = deser_uint256(f)
 
     def serialize(self):
-        r = b""
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
         r += struct.pack("<B", self.filter_type)
         r += struct.pack("<I", self.start_height)
         r += ser_uint256(self.stop_hash)
-        return r
 
     def __repr__(self):
         return "msg_getcfilters(filter_type={:#x}, start_height={}, stop_hash={:x})".format(
@@ -2005,11 +2485,14 @@ class msg_cfilter:
         self.filter_data = deser_string(f)
 
     def serialize(self):
-        r = b""
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
         r += struct.pack("<B", self.filter_type)
         r += ser_uint256(self.block_hash)
-        r += ser_string(self.filter_data)
-        return r
+        ser_string_into(r, self.filter_data)
 
     def __repr__(self):
         return "msg_cfilter(filter_type={:#x}, block_hash={:x})".format(
@@ -2031,11 +2514,14 @@ class msg_getcfheaders:
         self.stop_hash = deser_uint256(f)
 
     def serialize(self):
-        r = b""
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
         r += struct.pack("<B", self.filter_type)
         r += struct.pack("<I", self.start_height)
         r += ser_uint256(self.stop_hash)
-        return r
 
     def __repr__(self):
         return "msg_getcfheaders(filter_type={:#x}, start_height={}, stop_hash={:x})".format(
@@ -2060,12 +2546,15 @@ class msg_cfheaders:
         self.hashes = deser_uint256_vector(f)
 
     def serialize(self):
-        r = b""
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
         r += struct.pack("<B", self.filter_type)
         r += ser_uint256(self.stop_hash)
         r += ser_uint256(self.prev_header)
         r += ser_uint256_vector(self.hashes)
-        return r
 
     def __repr__(self):
         return "msg_cfheaders(filter_type={:#x}, stop_hash={:x})".format(
@@ -2085,10 +2574,13 @@ class msg_getcfcheckpt:
         self.stop_hash = deser_uint256(f)
 
     def serialize(self):
-        r = b""
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
         r += struct.pack("<B", self.filter_type)
         r += ser_uint256(self.stop_hash)
-        return r
 
     def __repr__(self):
         return "msg_getcfcheckpt(filter_type={:#x}, stop_hash={:x})".format(
@@ -2110,11 +2602,14 @@ class msg_cfcheckpt:
         self.headers = deser_uint256_vector(f)
 
     def serialize(self):
-        r = b""
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
         r += struct.pack("<B", self.filter_type)
         r += ser_uint256(self.stop_hash)
         r += ser_uint256_vector(self.headers)
-        return r
 
     def __repr__(self):
         return "msg_cfcheckpt(filter_type={:#x}, stop_hash={:x})".format(
@@ -2133,9 +2628,12 @@ class msg_avaproof():
         self.proof.deserialize(f)
 
     def serialize(self):
-        r = b""
-        r += self.proof.serialize()
-        return r
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        self.proof.serialize_into(r)
 
     def __repr__(self):
         return "msg_avaproof(proof={})".format(repr(self.proof))
@@ -2152,9 +2650,12 @@ class msg_avapoll():
         self.poll.deserialize(f)
 
     def serialize(self):
-        r = b""
-        r += self.poll.serialize()
-        return r
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        self.poll.serialize_into(r)
 
     def __repr__(self):
         return "msg_avapoll(poll={})".format(repr(self.poll))
@@ -2171,9 +2672,12 @@ class msg_avaresponse():
         self.response.deserialize(f)
 
     def serialize(self):
-        r = b""
-        r += self.response.serialize()
-        return r
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        self.response.serialize_into(r)
 
     def __repr__(self):
         return "msg_avaresponse(response={})".format(repr(self.response))
@@ -2190,9 +2694,12 @@ class msg_tcpavaresponse():
         self.response.deserialize(f)
 
     def serialize(self):
-        r = b""
-        r += self.response.serialize()
-        return r
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        self.response.serialize_into(r)
 
     def __repr__(self):
         return "msg_tcpavaresponse(response={})".format(repr(self.response))
@@ -2209,15 +2716,132 @@ class msg_avahello():
         self.hello.deserialize(f)
 
     def serialize(self):
-        r = b""
-        r += self.hello.serialize()
-        return r
+        r = bytearray()
+        self.serialize_into(r)
+        return bytes(r)
+
+    def serialize_into(self, r):
+        self.hello.serialize_into(r)
 
     def __repr__(self):
         return "msg_avahello(response={})".format(repr(self.hello))
 
 
 class TestFrameworkMessages(unittest.TestCase):
+    def test_buffer_reader(self):
+        """Check that BufferReader deserializes exactly like BytesIO and
+        tracks its offset through nested objects."""
+        tx = CTransaction()
+        tx.vin.append(CTxIn(COutPoint(0xdeadbeef << 200, 3), b"\x51" * 300,
+                            0xfffffffe))
+        tx.vout.append(CTxOut(42 * COIN, b"\x6a" * 70000))
+        block = CBlock()
+        block.nHeight = 1234
+        block.hashPrevBlock = 0xabcdef << 128
+        block.vMetadata = [CBlockMetadataField(7, b"\x01\x02")]
+        block.vtx = [tx, CTransaction(tx)]
+        block.update_size()
+        raw = block.serialize()
+
+        from_bytesio = CBlock()
+        from_bytesio.deserialize(BytesIO(raw))
+        reader = BufferReader(raw + b"\xff")
+        from_reader = CBlock()
+        from_reader.deserialize(reader)
+        self.assertEqual(from_reader.serialize(), raw)
+        self.assertEqual(from_bytesio.serialize(), raw)
+        self.assertEqual(reader.tell(), len(raw))
+        self.assertEqual(reader.remaining(), 1)
+        self.assertEqual(from_reader.vtx[0].vin[0].prevout.hash,
+                         0xdeadbeef << 200)
+
+        reader = BufferReader(raw, BLOCK_HEADER_SIZE)
+        self.assertEqual(deser_vector(reader, CBlockMetadataField)[0].data,
+                         b"\x01\x02")
+        self.assertRaises(struct.error, BufferReader(raw[:31]).view, 32)
+
+    def test_uint256_conversions(self):
+        values = [0, 1, 0xffffffff, 1 << 128, UINT256_MASK,
+                  0x0123456789abcdef << 190]
+        for v in values:
+            self.assertEqual(uint256_from_str(ser_uint256(v)), v)
+            self.assertEqual(deser_uint256(BytesIO(ser_uint256(v))), v)
+        raw = ser_uint256_vector(values)
+        self.assertEqual(len(raw), 1 + 32 * len(values))
+        self.assertEqual(deser_uint256_vector(BytesIO(raw)), values)
+        self.assertEqual(deser_uint256_vector(BufferReader(raw)), values)
+        self.assertRaises(struct.error, deser_uint256_vector,
+                          BytesIO(raw[:-1]))
+        self.assertRaises(struct.error, deser_uint256, BytesIO(bytes(31)))
+
+    def test_cached_tx_hashes(self):
+        """Check that cached transaction hashes follow every kind of
+        mutation, including of nested objects and of the vin/vout lists."""
+        def uncached_hashes(tx):
+            fresh = CTransaction()
+            fresh.deserialize(BytesIO(tx.serialize()))
+            fresh.rehash()
+            return fresh.txhash, fresh.txid
+
+        tx = CTransaction()
+        tx.vin.append(CTxIn(COutPoint(1, 0), b"\x51", 0))
+        tx.vout.append(CTxOut(1, b"\x6a"))
+        mutations = [
+            lambda: setattr(tx, "nLockTime", 5),
+            lambda: setattr(tx.vin[0].prevout, "n", 2),
+            lambda: setattr(tx.vin[0].prevout, "hash", 3),
+            lambda: setattr(tx.vin[0], "scriptSig", b"\x52"),
+            lambda: setattr(tx.vin[0], "prevout", COutPoint(4, 0)),
+            lambda: setattr(tx.vout[0], "nValue", 6),
+            lambda: tx.vin.append(CTxIn(COutPoint(7, 1))),
+            lambda: tx.vout.append(CTxOut(8, b"\x6a")),
+            lambda: tx.vout.pop(0),
+            lambda: setattr(tx, "vin", [CTxIn(COutPoint(9, 9))]),
+        ]
+        seen = set()
+        for mutate in mutations:
+            mutate()
+            tx.rehash()
+            self.assertEqual((tx.txhash, tx.txid), uncached_hashes(tx))
+            seen.add(tx.txhash)
+            copied = CTransaction(tx)
+            copied.nVersion = 2
+            copied.rehash()
+            self.assertEqual((copied.txhash, copied.txid),
+                             uncached_hashes(copied))
+        self.assertEqual(len(seen), len(mutations))
+
+    def test_merkle_root(self):
+        """Check get_merkle_root and MerkleTree against a straightforward
+        pairwise implementation."""
+        def reference_merkle_root(hashes):
+            if not hashes:
+                return bytes(32), 0
+            num_layers = 1
+            while len(hashes) > 1:
+                num_layers += 1
+                if len(hashes) % 2:
+                    hashes = hashes + [bytes(32)]
+                hashes = [hash256(hashes[i] + hashes[i + 1])
+                          for i in range(0, len(hashes), 2)]
+            return hashes[0], num_layers
+
+        leaves = [sha256(i.to_bytes(2, 'little')) for i in range(300)]
+        tree = MerkleTree()
+        for n in list(range(18)) + [127, 128, 129, 300]:
+            expected = reference_merkle_root(leaves[:n])
+            self.assertEqual(get_merkle_root(leaves[:n]), expected)
+            self.assertEqual(MerkleTree(leaves[:n]).root(), expected)
+            while len(tree) < n:
+                tree.append(leaves[len(tree)])
+            self.assertEqual(tree.root(), expected)
+
+        modified = list(leaves)
+        for i in (0, 1, 150, 298, 299, -1):
+            modified[i] = hash256(modified[i])
+            tree[i] = modified[i]
+            self.assertEqual(tree.root(), reference_merkle_root(modified))
+
     def test_legacy_avalanche_proof_serialization_round_trip(self):
         """Verify that a LegacyAvalancheProof object is unchanged after a
         round-trip of deserialization-serialization.
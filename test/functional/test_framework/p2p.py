@@ -11,30 +11,40 @@ node's p2p interface. They can be used to send messages to the node, and
 callbacks can be registered that execute when messages are received from the
 node. Messages are sent to/received from the node on an asyncio event loop.
 State held inside the objects must be guarded by the p2p_lock to avoid data
-races between the main testing thread and the event loop.
+races between the main testing thread and the event loop. If the NetworkThread
+is sharded across several event loops, each P2PConnection is guarded by the
+lock of its own event loop instead, available as its p2p_lock attribute.
 
 P2PConnection: A low-level connection object to a node's P2P interface
 P2PInterface: A high-level interface object for communicating to a node over P2P
 P2PDataStore: A p2p interface class that keeps a store of transactions and blocks
               and can respond correctly to getdata and getheaders messages
+HeaderStore: A compact store of raw block headers used by P2PDataStore to answer
+              getheaders messages
 P2PTxInvStore: A p2p interface class that inherits from P2PDataStore, and keeps
               a count of how many times each txid has been announced."""
 
 import asyncio
+import itertools
 import logging
 import struct
 import sys
 import threading
-from collections import defaultdict
-from io import BytesIO
+import unittest
+from collections import defaultdict, deque
+from typing import FrozenSet
 
 from test_framework.messages import (
+    BLOCK_HEADER_SIZE,
     MAX_HEADERS_RESULTS,
     MSG_BLOCK,
     MSG_TX,
     MSG_TYPE_MASK,
     NODE_NETWORK,
+    BufferReader,
     CBlockHeader,
+    CInv,
+    CTransaction,
     msg_addr,
     msg_addrv2,
     msg_avahello,
@@ -54,6 +64,7 @@ from test_framework.messages import (
     msg_getblocks,
     msg_getblocktxn,
     msg_getdata,
+    msg_generic,
     msg_getheaders,
     msg_headers,
     msg_inv,
@@ -69,6 +80,7 @@ from test_framework.messages import (
     msg_tx,
     msg_verack,
     msg_version,
+    ser_compact_size,
     sha256,
 )
 from test_framework.util import MAX_NODES, p2p_port, wait_until_helper
@@ -88,6 +100,23 @@ P2P_SUBVERSION = "/python-p2p-tester:0.0.3/"
 # Value for relay that this test framework sends in its `version` message
 P2P_VERSION_RELAY = 1
 
+
+def _calc_tx_hashes(message):
+    message.tx.calc_txid()
+    return [message.tx.txid]
+
+
+# Functions returning the hashes of the objects carried by a received message,
+# used to index the messages received by a P2PInterface
+RECEIVED_HASHES = {
+    "block": lambda message: [message.block.rehash()],
+    "getdata": lambda message: [inv.hash for inv in message.inv],
+    "headers": lambda message: [h.rehash() for h in message.headers],
+    "inv": lambda message: [inv.hash for inv in message.inv],
+    "notfound": lambda message: [inv.hash for inv in message.vec],
+    "tx": _calc_tx_hashes,
+}
+
 MESSAGEMAP = {
     b"addr": msg_addr,
     b"addrv2": msg_addrv2,
@@ -125,6 +154,9 @@ MESSAGEMAP = {
     b"version": msg_version,
 }
 
+# magic, msgtype, payload length and checksum
+MSG_HEADER = struct.Struct("<4s12si4s")
+
 MAGIC_BYTES = {
     "mainnet": b"\xec\xe7\xef\xf3",
     "testnet3": b"\xec\xf4\xf3\xf4",
@@ -132,6 +164,58 @@ MAGIC_BYTES = {
 }
 
 
+def eager_decode(handler):
+    """Decorator for the on_<msgtype> handlers of a lazy_decode connection,
+    for message types that must be deserialized as soon as they are received
+    (e.g. so that malformed messages raise in the receive path)."""
+    handler.eager_decode = True
+    return handler
+
+
+class LazyMessage:
+    """A received P2P message which is deserialized on first attribute access.
+
+    The raw payload is kept until then, so that messages which are never
+    inspected by the test (large blocks, addr or inv floods, ...) cost no
+    more than a copy of their payload."""
+    __slots__ = ("msgtype", "_msg_class", "_payload", "_message")
+
+    def __init__(self, msg_class, payload):
+        object.__setattr__(self, "msgtype", msg_class.msgtype)
+        object.__setattr__(self, "_msg_class", msg_class)
+        object.__setattr__(self, "_payload", bytes(payload))
+        object.__setattr__(self, "_message", None)
+
+    def is_decoded(self):
+        return self._message is not None
+
+    def decode(self):
+        """Deserialize the payload if needed and return the message object."""
+        if self._message is None:
+            message = self._msg_class()
+            message.deserialize(BufferReader(self._payload))
+            object.__setattr__(self, "_message", message)
+            object.__setattr__(self, "_payload", None)
+        return self._message
+
+    def serialize(self):
+        if self._message is None:
+            return self._payload
+        return self._message.serialize()
+
+    def __getattr__(self, name):
+        return getattr(self.decode(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.decode(), name, value)
+
+    def __repr__(self):
+        if self._message is None:
+            return "{}(<{} bytes, not decoded>)".format(
+                self._msg_class.__name__, len(self._payload))
+        return repr(self._message)
+
+
 class P2PConnection(asyncio.Protocol):
     """A low-level connection object to a node's P2P interface.
 
@@ -143,13 +227,23 @@ class P2PConnection(asyncio.Protocol):
     - logging messages as they are sent and received
 
     This class contains no logic for handing the P2P message payloads. It must be
-    sub-classed and the on_message() callback overridden."""
+    sub-classed and the on_message() callback overridden.
+
+    If lazy_decode is set, received payloads are passed to on_message() as
+    LazyMessage objects, which are only deserialized when one of their fields
+    is accessed, except for the message types whose on_<msgtype> handler is
+    decorated with eager_decode."""
+
+    # Whether to defer the deserialization of received messages
+    lazy_decode = False
 
     def __init__(self):
         # The underlying transport of the connection.
         # Should only call methods on this from the NetworkThread, c.f.
         # call_soon_threadsafe
         self._transport = None
+        # The lock guarding the state of this connection
+        self.p2p_lock = p2p_lock
 
     @property
     def is_connected(self):
@@ -157,19 +251,25 @@ class P2PConnection(asyncio.Protocol):
 
     def peer_connect_helper(self, dstaddr, dstport, net, timeout_factor):
         assert not self.is_connected
+        # The event loop this connection runs on, and its lock
+        self._loop = NetworkThread.network_event_loop
+        self.p2p_lock = p2p_lock
         self.timeout_factor = timeout_factor
         self.dstaddr = dstaddr
         self.dstport = dstport
         # The initial message to send after the connection was made:
         self.on_connection_send_msg = None
         self.on_connection_send_msg_is_raw = False
-        self.recvbuf = b""
+        self.recvbuf = bytearray()
+        # Position of the first unread byte in recvbuf
+        self.recvbuf_offset = 0
         self.magic_bytes = MAGIC_BYTES[net]
 
     def peer_connect(self, dstaddr, dstport, *, net, timeout_factor):
         self.peer_connect_helper(dstaddr, dstport, net, timeout_factor)
+        self._loop, self.p2p_lock = NetworkThread.get_shard()
 
-        loop = NetworkThread.network_event_loop
+        loop = self._loop
         logger.debug(
             'Connecting to Bitcoin ABC Node: {}:{}'.format(self.dstaddr, self.dstport))
         coroutine = loop.create_connection(
@@ -186,7 +286,7 @@ class P2PConnection(asyncio.Protocol):
 
     def peer_disconnect(self):
         # Connection could have already been closed by other end.
-        NetworkThread.network_event_loop.call_soon_threadsafe(
+        self._loop.call_soon_threadsafe(
             lambda: self._transport and self._transport.abort())
 
     # Connection and disconnection methods
@@ -205,6 +305,7 @@ class P2PConnection(asyncio.Protocol):
             # Never used again
             self.on_connection_send_msg = None
         self.on_open()
+        self._notify_waiters()
 
     def connection_lost(self, exc):
         """asyncio callback when a connection is closed."""
@@ -215,15 +316,23 @@ class P2PConnection(asyncio.Protocol):
             logger.debug("Closed connection to: {}:{}".format(
                 self.dstaddr, self.dstport))
         self._transport = None
-        self.recvbuf = b""
+        self.recvbuf = bytearray()
+        self.recvbuf_offset = 0
         self.on_close()
+        self._notify_waiters()
 
     # Socket read methods
 
     def data_received(self, t):
         """asyncio callback when data is read from the socket."""
-        with p2p_lock:
+        with self.p2p_lock:
             if len(t) > 0:
+                # Drop the bytes already read once they make up at least half
+                # of the buffer, so that the remaining data is moved at most
+                # a constant number of times on average.
+                if self.recvbuf_offset * 2 >= len(self.recvbuf):
+                    del self.recvbuf[:self.recvbuf_offset]
+                    self.recvbuf_offset = 0
                 self.recvbuf += t
 
         while True:
@@ -231,6 +340,12 @@ class P2PConnection(asyncio.Protocol):
             if msg is None:
                 break
             self.on_message(msg)
+        self._notify_waiters()
+
+    def _notify_waiters(self):
+        """Wake up the threads waiting for a change of this connection's state."""
+        with self.p2p_lock:
+            self.p2p_lock.notify_all()
 
     def _on_data(self):
         """Try to read P2P messages from the recv buffer.
@@ -239,34 +354,45 @@ class P2PConnection(asyncio.Protocol):
         parses and verifies the P2P header, then passes the P2P payload to
         the on_message callback for processing."""
         try:
-            with p2p_lock:
-                if len(self.recvbuf) < 4:
+            with self.p2p_lock:
+                offset = self.recvbuf_offset
+                available = len(self.recvbuf) - offset
+                if available < 4:
                     return None
-                if self.recvbuf[:4] != self.magic_bytes:
+                if self.recvbuf[offset:offset + 4] != self.magic_bytes:
                     raise ValueError(
                         "magic bytes mismatch: {} != {}".format(
                             repr(
                                 self.magic_bytes), repr(
-                                self.recvbuf)))
-                if len(self.recvbuf) < 4 + 12 + 4 + 4:
+                                bytes(self.recvbuf[offset:]))))
+                if available < 4 + 12 + 4 + 4:
                     return None
-                msgtype = self.recvbuf[4:4 + 12].split(b"\x00", 1)[0]
-                msglen = struct.unpack(
-                    "<i", self.recvbuf[4 + 12:4 + 12 + 4])[0]
-                checksum = self.recvbuf[4 + 12 + 4:4 + 12 + 4 + 4]
-                if len(self.recvbuf) < 4 + 12 + 4 + 4 + msglen:
+                magic, msgtype, msglen, checksum = MSG_HEADER.unpack_from(
+                    self.recvbuf, offset)
+                msgtype = msgtype.split(b"\x00", 1)[0]
+                if available < 4 + 12 + 4 + 4 + msglen:
                     return None
-                msg = self.recvbuf[4 + 12 + 4 + 4:4 + 12 + 4 + 4 + msglen]
+                start = offset + 4 + 12 + 4 + 4
+                # Copy the payload out, so that no view on the buffer outlives
+                # this call and prevents it from being resized.
+                msg = bytes(memoryview(self.recvbuf)[start:start + msglen])
                 h = sha256(sha256(msg))
                 if checksum != h[:4]:
-                    raise ValueError("got bad checksum " + repr(self.recvbuf))
-                self.recvbuf = self.recvbuf[4 + 12 + 4 + 4 + msglen:]
+                    raise ValueError(
+                        "got bad checksum " + repr(bytes(self.recvbuf[offset:])))
+                self.recvbuf_offset = start + msglen
                 if msgtype not in MESSAGEMAP:
                     raise ValueError("Received unknown msgtype from {}:{}: '{}' {}".format(
                         self.dstaddr, self.dstport, msgtype, repr(msg)))
-                f = BytesIO(msg)
-                m = MESSAGEMAP[msgtype]()
-                m.deserialize(f)
+                msg_class = MESSAGEMAP[msgtype]
+                if self.lazy_decode and not getattr(
+                        getattr(self, 'on_' + msgtype.decode('ascii'), None),
+                        'eager_decode', False):
+                    m = LazyMessage(msg_class, msg)
+                else:
+                    f = BufferReader(msg)
+                    m = msg_class()
+                    m.deserialize(f)
                 self._log_message("receive", m)
                 return m
         except Exception as e:
@@ -290,6 +416,22 @@ class P2PConnection(asyncio.Protocol):
         self._log_message("send", message)
         return self.send_raw_message(tmsg)
 
+    def send_messages(self, messages, *, checksum_cache=None):
+        """Send several P2P messages over the socket at once.
+
+        The messages are serialized into one buffer which is written to the
+        transport by a single callback on the network thread. If a dict is
+        passed as checksum_cache, the payload checksums are looked up and
+        stored there, so that identical payloads are only hashed once (the
+        same dict can be reused across calls)."""
+        if not self.is_connected:
+            raise IOError('Not connected')
+        tmsgs = bytearray()
+        for message in messages:
+            self.build_message_into(tmsgs, message, checksum_cache)
+            self._log_message("send", message)
+        return self.send_raw_message(bytes(tmsgs))
+
     def send_raw_message(self, raw_message_bytes):
         """Send any raw message over the socket.
 
@@ -304,23 +446,33 @@ class P2PConnection(asyncio.Protocol):
             if self._transport.is_closing():
                 return
             self._transport.write(raw_message_bytes)
-        NetworkThread.network_event_loop.call_soon_threadsafe(maybe_write)
+        self._loop.call_soon_threadsafe(maybe_write)
 
     # Class utility methods
 
     def build_message(self, message):
         """Build a serialized P2P message"""
-        msgtype = message.msgtype
+        tmsg = bytearray()
+        self.build_message_into(tmsg, message)
+        return bytes(tmsg)
+
+    def build_message_into(self, r, message, checksum_cache=None):
+        """Append a serialized P2P message to the bytearray r"""
         data = message.serialize()
-        tmsg = self.magic_bytes
-        tmsg += msgtype
-        tmsg += b"\x00" * (12 - len(msgtype))
-        tmsg += struct.pack("<I", len(data))
-        th = sha256(data)
-        h = sha256(th)
-        tmsg += h[:4]
-        tmsg += data
-        return tmsg
+        checksum = None
+        if checksum_cache is not None:
+            checksum = checksum_cache.get(data)
+        if checksum is None:
+            checksum = sha256(sha256(data))[:4]
+            if checksum_cache is not None:
+                checksum_cache[data] = checksum
+        msgtype = message.msgtype
+        r += self.magic_bytes
+        r += msgtype
+        r += b"\x00" * (12 - len(msgtype))
+        r += struct.pack("<I", len(data))
+        r += checksum
+        r += data
 
     def _log_message(self, direction, msg):
         """Logs a message being sent or received over the connection."""
@@ -345,6 +497,13 @@ class P2PInterface(P2PConnection):
     Individual testcases should subclass this and override the on_* methods
     if they want to alter message handling behaviour."""
 
+    # The message types (keys of RECEIVED_HASHES) whose object hashes are
+    # indexed in received_hashes. Indexing decodes and hashes every such
+    # message on the network thread, so it is opt-in, see index_received().
+    indexed_msgtypes: FrozenSet[str] = frozenset()
+    # The number of messages of each type kept in received_messages
+    max_received_messages = 0
+
     def __init__(self, support_addrv2=False):
         super().__init__()
 
@@ -357,6 +516,14 @@ class P2PInterface(P2PConnection):
         # this and use self.wait_until.
         self.last_message = {}
 
+        # The last max_received_messages messages of each type received, and
+        # for the types in indexed_msgtypes, the hashes of all the objects
+        # (inv hashes, txids, block hashes) they carried. Should be read-only
+        # in a test, see has_received().
+        self.received_messages = defaultdict(
+            lambda: deque(maxlen=self.max_received_messages))
+        self.received_hashes = defaultdict(set)
+
         # A count of the number of ping messages we've sent to the node
         self.ping_counter = 1
 
@@ -402,11 +569,16 @@ class P2PInterface(P2PConnection):
 
         We keep a count of how many of each message type has been received
         and the most recent message of each type."""
-        with p2p_lock:
+        with self.p2p_lock:
             try:
                 msgtype = message.msgtype.decode('ascii')
                 self.message_count[msgtype] += 1
                 self.last_message[msgtype] = message
+                if self.max_received_messages:
+                    self.received_messages[msgtype].append(message)
+                if msgtype in self.indexed_msgtypes:
+                    self.received_hashes[msgtype].update(
+                        RECEIVED_HASHES[msgtype](message))
                 getattr(self, 'on_' + msgtype)(message)
             except Exception:
                 print("ERROR delivering {} ({})".format(
@@ -505,6 +677,19 @@ class P2PInterface(P2PConnection):
         self.nServices = message.nServices
         self.send_message(msg_getaddr())
 
+    def index_received(self, *msgtypes):
+        """Index the object hashes of the messages of types msgtypes received
+        from now on, see has_received()."""
+        with self.p2p_lock:
+            self.indexed_msgtypes = self.indexed_msgtypes | frozenset(msgtypes)
+
+    def has_received(self, msgtype, obj_hash):
+        """Whether a message of type msgtype carrying the object (inv, tx or
+        block) with hash obj_hash was received since msgtype is indexed. Must
+        be called with the p2p_lock held, e.g. from a wait_until()
+        predicate."""
+        return obj_hash in self.received_hashes[msgtype]
+
     # Connection helper methods
 
     def wait_until(self, test_function_in, *, timeout=60,
@@ -514,12 +699,12 @@ class P2PInterface(P2PConnection):
                 assert self.is_connected
             return test_function_in()
 
-        wait_until_helper(test_function, timeout=timeout, lock=p2p_lock,
+        wait_until_helper(test_function, timeout=timeout, lock=self.p2p_lock,
                           timeout_factor=self.timeout_factor)
 
     def wait_for_connect(self, timeout=60):
         def test_function(): return self.is_connected
-        wait_until_helper(test_function, timeout=timeout, lock=p2p_lock)
+        wait_until_helper(test_function, timeout=timeout, lock=self.p2p_lock)
 
     def wait_for_disconnect(self, timeout=60):
         def test_function(): return not self.is_connected
@@ -528,7 +713,13 @@ class P2PInterface(P2PConnection):
     # Message receiving helper methods
 
     def wait_for_tx(self, txid, timeout=60):
+        # Also catch the tx if other txs are received while waiting. The last
+        # tx received may have arrived before the txs were indexed.
+        self.index_received("tx")
+
         def test_function():
+            if self.has_received("tx", int(txid, 16)):
+                return True
             if not self.last_message.get('tx'):
                 return False
             self.last_message['tx'].tx.calc_txid()
@@ -537,9 +728,14 @@ class P2PInterface(P2PConnection):
         self.wait_until(test_function, timeout=timeout)
 
     def wait_for_block(self, blockhash, timeout=60):
+        # Also catch the block if other blocks are received while waiting.
+        # The last block received may have arrived before the blocks were
+        # indexed.
+        self.index_received("block")
+
         def test_function():
-            return self.last_message.get(
-                "block") and self.last_message["block"].block.rehash() == blockhash
+            return self.has_received("block", blockhash) or (self.last_message.get(
+                "block") and self.last_message["block"].block.rehash() == blockhash)
 
         self.wait_until(test_function, timeout=timeout)
 
@@ -635,36 +831,67 @@ class P2PInterface(P2PConnection):
 # P2PConnection acquires this lock whenever delivering a message to a P2PInterface.
 # This lock should be acquired in the thread running the test logic to synchronize
 # access to any data shared with the P2PInterface or P2PConnection.
-p2p_lock = threading.Lock()
+# It is a condition variable, notified whenever messages are received or a
+# connection is opened or closed, so that wait_until() wakes up immediately.
+p2p_lock = threading.Condition(threading.Lock())
 
 
 class NetworkThread(threading.Thread):
+    """The thread running the asyncio event loop of the P2P connections.
+
+    With num_shards > 1, the outbound connections to the nodes (see
+    P2PConnection.peer_connect) are spread round-robin across num_shards event
+    loops, each running in its own thread and with its own lock, so that tests
+    simulating many peers are not bottlenecked by a single loop and lock. The
+    first shard is network_event_loop and p2p_lock, which also serve all the
+    listening connections."""
     network_event_loop = None
 
-    def __init__(self):
+    def __init__(self, num_shards=1):
         super().__init__(name="NetworkThread")
         # There is only one event loop and no more than one thread must be
         # created
         assert not self.network_event_loop
+        assert num_shards >= 1
 
         NetworkThread.listeners = {}
         NetworkThread.protos = {}
         NetworkThread.network_event_loop = asyncio.new_event_loop()
+        # (event loop, lock) of each shard
+        NetworkThread.shards = [(NetworkThread.network_event_loop, p2p_lock)]
+        NetworkThread.shard_counter = itertools.count()
+        self.shard_threads = []
+        for i in range(1, num_shards):
+            loop = asyncio.new_event_loop()
+            NetworkThread.shards.append(
+                (loop, threading.Condition(threading.Lock())))
+            self.shard_threads.append(threading.Thread(
+                name="NetworkThread-{}".format(i), target=loop.run_forever))
 
     def run(self):
         """Start the network thread."""
+        for thread in self.shard_threads:
+            thread.start()
         self.network_event_loop.run_forever()
 
     def close(self, timeout=10):
         """Close the connections and network event loop."""
-        self.network_event_loop.call_soon_threadsafe(
-            self.network_event_loop.stop)
-        wait_until_helper(lambda: not self.network_event_loop.is_running(),
-                          timeout=timeout)
-        self.network_event_loop.close()
+        for loop, _ in self.shards:
+            loop.call_soon_threadsafe(loop.stop)
+        for loop, _ in self.shards:
+            wait_until_helper(lambda: not loop.is_running(), timeout=timeout)
+            loop.close()
+        for thread in self.shard_threads:
+            thread.join(timeout)
         self.join(timeout)
         # Safe to remove event loop.
         NetworkThread.network_event_loop = None
+        NetworkThread.shards = []
+
+    @classmethod
+    def get_shard(cls):
+        """Return the event loop and lock for a new outbound connection."""
+        return cls.shards[next(cls.shard_counter) % len(cls.shards)]
 
     @classmethod
     def listen(cls, p2p, callback, port=None, addr=None, idx=1):
@@ -710,24 +937,99 @@ class NetworkThread(threading.Thread):
         callback(addr, port)
 
 
+class HeaderStore:
+    """A compact block header store.
+
+    The serialized headers are appended to one contiguous buffer, and
+    indexed by block hash. Walking back the chain and building a headers
+    message only reads that buffer, without constructing any CBlockHeader
+    object, which keeps getheaders cheap for tests with long chains."""
+
+    def __init__(self):
+        self.raw = bytearray()
+        # block hash -> position of the header in the buffer
+        self.index = {}
+        # position -> block hash and previous block hash
+        self.hashes = []
+        self.prev_hashes = []
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __contains__(self, block_hash):
+        return block_hash in self.index
+
+    def add(self, block):
+        """Store the header of a CBlock or CBlockHeader, which must have
+        been hashed."""
+        if block.sha256 in self.index:
+            return
+        self.index[block.sha256] = len(self.hashes)
+        self.hashes.append(block.sha256)
+        self.prev_hashes.append(block.hashPrevBlock)
+        CBlockHeader.serialize_into(block, self.raw)
+
+    def get_raw_header(self, block_hash):
+        offset = self.index[block_hash] * BLOCK_HEADER_SIZE
+        return self.raw[offset:offset + BLOCK_HEADER_SIZE]
+
+    def get_height(self, block_hash):
+        # nHeight is serialized at byte 60 of a Lotus block header
+        offset = self.index[block_hash] * BLOCK_HEADER_SIZE + 60
+        return int.from_bytes(self.raw[offset:offset + 4], 'little')
+
+    def get_headers_payload(self, tip_hash, locator, hash_stop):
+        """Return the payload of the headers message answering a getheaders
+        request, walking back from tip_hash until a block in the locator (or
+        hash_stop) is found. Return None if tip_hash is unknown."""
+        pos = self.index.get(tip_hash)
+        if pos is None:
+            return None
+        locator = set(locator)
+        positions = [pos]
+        while self.hashes[pos] not in locator:
+            prev_block_hash = self.prev_hashes[pos]
+            pos = self.index.get(prev_block_hash)
+            if pos is None:
+                logger.debug('block hash {} not found in block store'.format(
+                    hex(prev_block_hash)))
+                break
+            positions.append(pos)
+            if prev_block_hash == hash_stop:
+                # if this is the hashstop header, stop here
+                break
+
+        # Keep the oldest headers if there are too many, in ascending order
+        positions = positions[:-MAX_HEADERS_RESULTS - 1:-1]
+        payload = bytearray(ser_compact_size(len(positions)))
+        with memoryview(self.raw) as view:
+            for pos in positions:
+                payload += view[pos * BLOCK_HEADER_SIZE:
+                                (pos + 1) * BLOCK_HEADER_SIZE]
+        return bytes(payload)
+
+
 class P2PDataStore(P2PInterface):
     """A P2P data store class.
 
     Keeps a block and transaction store and responds correctly to getdata and getheaders requests."""
 
+    # send_blocks_and_test() waits for the getdata of the blocks it announces
+    indexed_msgtypes = frozenset({"getdata"})
+
     def __init__(self):
         super().__init__()
         # store of blocks. key is block hash, value is a CBlock object
         self.block_store = {}
+        # compact copy of the headers of block_store, for getheaders
+        self.header_store = HeaderStore()
         self.last_block_hash = ''
         # store of txs. key is txid, value is a CTransaction object
         self.tx_store = {}
-        self.getdata_requests = []
 
     def on_getdata(self, message):
         """Check for the tx/block in our stores and if found, reply with an inv message."""
         for inv in message.inv:
-            self.getdata_requests.append(inv.hash)
             if (inv.type & MSG_TYPE_MASK) == MSG_TX and inv.hash in self.tx_store.keys():
                 self.send_message(msg_tx(self.tx_store[inv.hash]))
             elif (inv.type & MSG_TYPE_MASK) == MSG_BLOCK and inv.hash in self.block_store.keys():
@@ -745,29 +1047,10 @@ class P2PDataStore(P2PInterface):
         if not self.block_store:
             return
 
-        headers_list = [self.block_store[self.last_block_hash]]
-        while headers_list[-1].sha256 not in locator.vHave:
-            # Walk back through the block store, adding headers to headers_list
-            # as we go.
-            prev_block_hash = headers_list[-1].hashPrevBlock
-            if prev_block_hash in self.block_store:
-                prev_block_header = CBlockHeader(
-                    self.block_store[prev_block_hash])
-                headers_list.append(prev_block_header)
-                if prev_block_header.sha256 == hash_stop:
-                    # if this is the hashstop header, stop here
-                    break
-            else:
-                logger.debug('block hash {} not found in block store'.format(
-                    hex(prev_block_hash)))
-                break
-
-        # Truncate the list if there are too many headers
-        headers_list = headers_list[:-MAX_HEADERS_RESULTS - 1:-1]
-        response = msg_headers(headers_list)
-
-        if response is not None:
-            self.send_message(response)
+        payload = self.header_store.get_headers_payload(
+            self.last_block_hash, locator.vHave, hash_stop)
+        if payload is not None:
+            self.send_message(msg_generic(b"headers", payload))
 
     def send_blocks_and_test(self, blocks, node, *, success=True, force_send=False,
                              reject_reason=None, expect_disconnect=False, timeout=60):
@@ -782,21 +1065,21 @@ class P2PDataStore(P2PInterface):
          - if success is False: assert that the node's tip doesn't advance
          - if reject_reason is set: assert that the correct reject message is logged"""
 
-        with p2p_lock:
+        with self.p2p_lock:
             for block in blocks:
                 self.block_store[block.sha256] = block
+                self.header_store.add(block)
                 self.last_block_hash = block.sha256
 
         def test():
             if force_send:
-                for b in blocks:
-                    self.send_message(msg_block(block=b))
+                self.send_messages([msg_block(block=b) for b in blocks])
 
             else:
                 self.send_message(
                     msg_headers([CBlockHeader(block) for block in blocks]))
                 self.wait_until(
-                    lambda: blocks[-1].sha256 in self.getdata_requests,
+                    lambda: self.has_received("getdata", blocks[-1].sha256),
                     timeout=timeout,
                     check_connected=success,
                 )
@@ -828,13 +1111,12 @@ class P2PDataStore(P2PInterface):
          - if expect_disconnect is True: Skip the sync with ping
          - if reject_reason is set: assert that the correct reject message is logged."""
 
-        with p2p_lock:
+        with self.p2p_lock:
             for tx in txs:
                 self.tx_store[tx.txid] = tx
 
         def test():
-            for tx in txs:
-                self.send_message(msg_tx(tx))
+            self.send_messages([msg_tx(tx) for tx in txs])
 
             if expect_disconnect:
                 self.wait_for_disconnect()
@@ -877,7 +1159,7 @@ class P2PTxInvStore(P2PInterface):
                 self.tx_invs_received[i.hash] += 1
 
     def get_invs(self):
-        with p2p_lock:
+        with self.p2p_lock:
             return list(self.tx_invs_received.keys())
 
     def wait_for_broadcast(self, txns, timeout=60):
@@ -889,3 +1171,180 @@ class P2PTxInvStore(P2PInterface):
             [int(tx, 16) for tx in txns]), timeout=timeout)
         # Flush messages and wait for the getdatas to be processed
         self.sync_with_ping()
+
+
+class TestFrameworkP2P(unittest.TestCase):
+    def test_header_store(self):
+        headers = []
+        prev_hash = 0
+        for height in range(MAX_HEADERS_RESULTS + 10):
+            header = CBlockHeader()
+            header.hashPrevBlock = prev_hash
+            header.nHeight = height
+            header.nTime = 1600000000 + height
+            header.rehash()
+            headers.append(header)
+            prev_hash = header.sha256
+        # A fork off height 5
+        fork = CBlockHeader(headers[5])
+        fork.hashPrevBlock = headers[4].sha256
+        fork.nTime += 1
+        fork.rehash()
+
+        store = HeaderStore()
+        for header in headers + [headers[3], fork]:
+            store.add(header)
+        self.assertEqual(len(store), len(headers) + 1)
+        self.assertIn(fork.sha256, store)
+        self.assertEqual(store.get_height(headers[42].sha256), 42)
+        self.assertEqual(bytes(store.get_raw_header(headers[42].sha256)),
+                         headers[42].serialize())
+
+        def get_headers(tip, locator, hash_stop=0):
+            response = msg_headers()
+            response.deserialize(BufferReader(
+                store.get_headers_payload(tip.sha256, locator, hash_stop)))
+            for header in response.headers:
+                header.rehash()
+            return [header.sha256 for header in response.headers]
+
+        tip = headers[-1]
+        # The locator block is included, and at most MAX_HEADERS_RESULTS of
+        # the oldest headers are returned in ascending order.
+        self.assertEqual(get_headers(tip, [headers[0].sha256]),
+                         [h.sha256 for h in headers[:MAX_HEADERS_RESULTS]])
+        self.assertEqual(get_headers(tip, [headers[-3].sha256]),
+                         [h.sha256 for h in headers[-3:]])
+        self.assertEqual(get_headers(tip, [tip.sha256]), [tip.sha256])
+        # Stop at hash_stop, or at the start of the chain
+        self.assertEqual(
+            get_headers(tip, [headers[0].sha256], headers[-4].sha256),
+            [h.sha256 for h in headers[-4:]])
+        self.assertEqual(get_headers(headers[3], [fork.sha256]),
+                         [h.sha256 for h in headers[:4]])
+        self.assertEqual(get_headers(fork, [headers[2].sha256]),
+                         [headers[2].sha256, headers[3].sha256,
+                          headers[4].sha256, fork.sha256])
+        self.assertIsNone(store.get_headers_payload(1, [], 0))
+
+    def test_lazy_decode(self):
+        class TestConnection(P2PConnection):
+            lazy_decode = True
+
+            @eager_decode
+            def on_ping(self, message):
+                pass
+
+        conn = TestConnection()
+        conn.peer_connect_helper('0', 0, 'regtest', 1)
+        ping, pong = msg_ping(nonce=5), msg_pong(nonce=6)
+        conn.recvbuf += conn.build_message(ping) + conn.build_message(pong)
+
+        received_ping = conn._on_data()
+        self.assertIsInstance(received_ping, msg_ping)
+        self.assertEqual(received_ping.nonce, 5)
+
+        received_pong = conn._on_data()
+        self.assertIsInstance(received_pong, LazyMessage)
+        self.assertEqual(received_pong.msgtype, b"pong")
+        self.assertFalse(received_pong.is_decoded())
+        self.assertEqual(received_pong.serialize(), pong.serialize())
+        self.assertIn("not decoded", repr(received_pong))
+        self.assertEqual(received_pong.nonce, 6)
+        self.assertTrue(received_pong.is_decoded())
+        received_pong.nonce = 7
+        self.assertEqual(received_pong.decode().nonce, 7)
+        self.assertEqual(repr(received_pong), repr(msg_pong(nonce=7)))
+        self.assertIsNone(conn._on_data())
+
+    def test_recvbuf_framing(self):
+        class TestConnection(P2PConnection):
+            def on_message(self, message):
+                self.received.append(message.nonce)
+
+        conn = TestConnection()
+        conn.peer_connect_helper('0', 0, 'regtest', 1)
+        conn.received = []
+        stream = b"".join(conn.build_message(msg_ping(nonce=i))
+                          for i in range(100))
+        # Feed the stream in chunks that do not line up with messages
+        for i in range(0, len(stream), 7):
+            conn.data_received(stream[i:i + 7])
+            self.assertLessEqual(len(conn.recvbuf), 2 * (32 + 7))
+        self.assertEqual(conn.received, list(range(100)))
+        self.assertEqual(conn.recvbuf_offset, len(conn.recvbuf))
+
+    def test_build_messages(self):
+        conn = P2PConnection()
+        conn.peer_connect_helper('0', 0, 'regtest', 1)
+        ping = msg_ping(nonce=1)
+        tmsg = conn.build_message(ping)
+        self.assertEqual(tmsg[:4], conn.magic_bytes)
+        self.assertEqual(tmsg[4:16], b"ping" + b"\x00" * 8)
+        self.assertEqual(tmsg[16:20], (8).to_bytes(4, 'little'))
+        self.assertEqual(tmsg[20:24], sha256(sha256(ping.serialize()))[:4])
+        self.assertEqual(tmsg[24:], ping.serialize())
+
+        checksum_cache = {}
+        tmsgs = bytearray()
+        for message in [ping, msg_ping(nonce=2), ping]:
+            conn.build_message_into(tmsgs, message, checksum_cache)
+        self.assertEqual(len(checksum_cache), 2)
+        self.assertEqual(bytes(tmsgs), tmsg + conn.build_message(
+            msg_ping(nonce=2)) + tmsg)
+
+    def test_network_thread_shards(self):
+        network_thread = NetworkThread(num_shards=3)
+        network_thread.start()
+        try:
+            shards = [NetworkThread.get_shard() for _ in range(6)]
+            self.assertEqual(shards[:3], shards[3:])
+            self.assertIs(shards[0][0], NetworkThread.network_event_loop)
+            self.assertIs(shards[0][1], p2p_lock)
+            self.assertEqual(len({id(lock) for _, lock in shards}), 3)
+
+            async def thread_name():
+                return threading.current_thread().name
+            self.assertEqual(
+                [asyncio.run_coroutine_threadsafe(thread_name(), loop).result(
+                    timeout=10) for loop, _ in shards[:3]],
+                ["NetworkThread", "NetworkThread-1", "NetworkThread-2"])
+        finally:
+            network_thread.close()
+        self.assertIsNone(NetworkThread.network_event_loop)
+        self.assertFalse(network_thread.is_alive())
+
+    def test_received_index(self):
+        conn = P2PInterface()
+        conn.on_message(msg_tx(CTransaction()))
+        conn.on_message(msg_pong(nonce=1))
+        # Nothing is kept or indexed by default
+        self.assertEqual(conn.received_messages, {})
+        self.assertEqual(conn.received_hashes, {})
+
+        conn = P2PInterface()
+        conn.max_received_messages = 10
+        conn.index_received(*RECEIVED_HASHES)
+        tx = CTransaction()
+        tx.calc_txid()
+        header = CBlockHeader()
+        header.rehash()
+        messages = [
+            msg_getdata([CInv(MSG_TX, i) for i in range(100)]),
+            msg_tx(tx),
+            msg_headers([header]),
+            msg_notfound([CInv(MSG_BLOCK, 1000)]),
+        ]
+        for _ in range(11):
+            conn.on_message(msg_pong(nonce=1))
+        for message in messages:
+            conn.on_message(message)
+
+        self.assertEqual(len(conn.received_messages["pong"]), 10)
+        self.assertEqual(conn.message_count["pong"], 11)
+        self.assertTrue(conn.has_received("getdata", 42))
+        self.assertFalse(conn.has_received("getdata", 100))
+        self.assertFalse(conn.has_received("inv", 42))
+        self.assertTrue(conn.has_received("tx", tx.txid))
+        self.assertTrue(conn.has_received("headers", header.sha256))
+        self.assertTrue(conn.has_received("notfound", 1000))
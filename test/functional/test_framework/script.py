@@ -9,10 +9,12 @@ This file is modified from python-bitcoinlib.
 
 import struct
 import unittest
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 from .messages import (
+    COutPoint,
     CTransaction,
+    CTxIn,
     CTxOut,
     get_merkle_root,
     hash256,
@@ -762,55 +764,127 @@ def TaggedHash(tag, data):
     return sha256(ss)
 
 
+class LotusSighashContext:
+    """Precomputed components of the Lotus sighashes of a transaction.
+
+    The hashes, merkle roots and sums which do not depend on the signed input
+    are computed once, on first use, so that signing all the inputs of a
+    transaction is linear in its size. The transaction and the spent outputs
+    must not change while the context is in use, except for the scriptSigs
+    which are not committed to.
+    """
+
+    def __init__(self, tx_to: CTransaction, spent_utxos: list):
+        assert len(tx_to.vin) == len(spent_utxos)
+        self.tx_to = tx_to
+        self.spent_utxos = spent_utxos
+        self._spent_utxos_serialized = None
+        self._spent_utxos_merkle_root = None
+        self._spent_amount = None
+        self._output_amount = None
+        self._inputs_merkle = None
+        self._outputs_merkle = None
+
+    def spent_utxo_serialized(self, input_index):
+        if self._spent_utxos_serialized is None:
+            self._spent_utxos_serialized = [
+                utxo.serialize() for utxo in self.spent_utxos]
+        return self._spent_utxos_serialized[input_index]
+
+    def spent_utxos_merkle_root(self):
+        if self._spent_utxos_merkle_root is None:
+            self._spent_utxos_merkle_root = get_merkle_root(
+                [hash256(self.spent_utxo_serialized(i))
+                 for i in range(len(self.spent_utxos))])[0]
+        return self._spent_utxos_merkle_root
+
+    def spent_amount(self):
+        if self._spent_amount is None:
+            self._spent_amount = sum(
+                utxo.nValue for utxo in self.spent_utxos)
+        return self._spent_amount
+
+    def output_amount(self):
+        if self._output_amount is None:
+            self._output_amount = sum(
+                output.nValue for output in self.tx_to.vout)
+        return self._output_amount
+
+    def inputs_merkle(self):
+        """Return the (root, height) of the inputs merkle tree"""
+        if self._inputs_merkle is None:
+            self._inputs_merkle = get_merkle_root(
+                [hash256(inpt.prevout.serialize() +
+                         inpt.nSequence.to_bytes(4, 'little'))
+                 for inpt in self.tx_to.vin])
+        return self._inputs_merkle
+
+    def outputs_merkle(self):
+        """Return the (root, height) of the outputs merkle tree"""
+        if self._outputs_merkle is None:
+            self._outputs_merkle = get_merkle_root(
+                [hash256(output.serialize()) for output in self.tx_to.vout])
+        return self._outputs_merkle
+
+    def sighash(
+            self,
+            sig_hash_type: int,
+            input_index: int,
+            executed_script_hash: Optional[bytes] = None,
+            codeseparator_pos=0xffff_ffff):
+        tx_to = self.tx_to
+        assert input_index < len(tx_to.vin)
+        out_type = sig_hash_type & 3
+        in_type = sig_hash_type & SIGHASH_ANYONECANPAY
+        ss = bytearray(sig_hash_type.to_bytes(4, 'little'))
+        spend_type = 0
+        if executed_script_hash is not None:
+            spend_type |= 2
+        ss += hash256(
+            bytes([spend_type]) +
+            tx_to.vin[input_index].prevout.serialize() +
+            tx_to.vin[input_index].nSequence.to_bytes(4, 'little') +
+            self.spent_utxo_serialized(input_index))
+        if executed_script_hash is not None:
+            assert len(executed_script_hash) == 32
+            ss += codeseparator_pos.to_bytes(4, 'little')
+            ss += executed_script_hash
+        if in_type != SIGHASH_ANYONECANPAY:
+            ss += input_index.to_bytes(4, 'little')
+            ss += self.spent_utxos_merkle_root()
+            ss += self.spent_amount().to_bytes(8, 'little')
+        if out_type == SIGHASH_ALL:
+            ss += self.output_amount().to_bytes(8, 'little')
+        ss += tx_to.nVersion.to_bytes(4, 'little')
+        if in_type != SIGHASH_ANYONECANPAY:
+            inputs_merkle_root, inputs_merkle_height = self.inputs_merkle()
+            ss += inputs_merkle_root
+            ss += bytes([inputs_merkle_height])
+        if out_type == SIGHASH_SINGLE:
+            if input_index < len(tx_to.vout):
+                ss += hash256(tx_to.vout[input_index].serialize())
+            else:
+                raise ValueError(
+                    "Invalid sighash SINGLE, no corresponding output")
+        if out_type == SIGHASH_ALL:
+            outputs_merkle_root, outputs_merkle_height = self.outputs_merkle()
+            ss += outputs_merkle_root
+            ss += bytes([outputs_merkle_height])
+        ss += tx_to.nLockTime.to_bytes(4, 'little')
+        return hash256(ss)
+
+
 def SignatureHashLotus(
         tx_to: CTransaction,
         spent_utxos: list,
         sig_hash_type: int,
         input_index: int,
-        executed_script_hash: bytes = None,
+        executed_script_hash: Optional[bytes] = None,
         codeseparator_pos = 0xffff_ffff):
-    assert len(tx_to.vin) == len(spent_utxos)
-    assert input_index < len(tx_to.vin)
-    out_type = sig_hash_type & 3
-    in_type = sig_hash_type & SIGHASH_ANYONECANPAY
-    ss = bytearray(sig_hash_type.to_bytes(4, 'little'))
-    spend_type = 0
-    if executed_script_hash is not None:
-        spend_type |= 2
-    ss += hash256(
-        bytes([spend_type]) +
-        tx_to.vin[input_index].prevout.serialize() +
-        tx_to.vin[input_index].nSequence.to_bytes(4, 'little') +
-        spent_utxos[input_index].serialize())
-    if executed_script_hash is not None:
-        assert len(executed_script_hash) == 32
-        ss += codeseparator_pos.to_bytes(4, 'little')
-        ss += executed_script_hash
-    if in_type != SIGHASH_ANYONECANPAY:
-        ss += input_index.to_bytes(4, 'little')
-        ss += get_merkle_root([hash256(utxo.serialize()) for utxo in spent_utxos])[0]
-        ss += sum(utxo.nValue for utxo in spent_utxos).to_bytes(8, 'little')
-    if out_type == SIGHASH_ALL:
-        ss += sum(output.nValue for output in tx_to.vout).to_bytes(8, 'little')
-    ss += tx_to.nVersion.to_bytes(4, 'little')
-    if in_type != SIGHASH_ANYONECANPAY:
-        inputs_merkle_root, inputs_merkle_height = get_merkle_root(
-            [hash256(inpt.prevout.serialize() + inpt.nSequence.to_bytes(4, 'little'))
-             for inpt in tx_to.vin])
-        ss += inputs_merkle_root
-        ss += bytes([inputs_merkle_height])
-    if out_type == SIGHASH_SINGLE:
-        if input_index < len(tx_to.vout):
-            ss += hash256(tx_to.vout[input_index].serialize())
-        else:
-            raise ValueError("Invalid sighash SINGLE, no corresponding output")
-    if out_type == SIGHASH_ALL:
-        outputs_merkle_root, outputs_merkle_height = get_merkle_root(
-            [hash256(output.serialize()) for output in tx_to.vout])
-        ss += outputs_merkle_root
-        ss += bytes([outputs_merkle_height])
-    ss += tx_to.nLockTime.to_bytes(4, 'little')
-    return hash256(ss)
+    """Compute the Lotus sighash of a single input. Use a LotusSighashContext
+    to sign several inputs of the same transaction."""
+    return LotusSighashContext(tx_to, spent_utxos).sighash(
+        sig_hash_type, input_index, executed_script_hash, codeseparator_pos)
 
 
 class TestFrameworkScript(unittest.TestCase):
@@ -849,3 +923,36 @@ class TestFrameworkScript(unittest.TestCase):
             self.assertEqual(
                 CScriptNum.decode(CScriptNum.encode(CScriptNum(value))),
                 value)
+
+    def test_lotus_sighash_context(self):
+        tx = CTransaction()
+        for i in range(3):
+            tx.vin.append(CTxIn(COutPoint(i * 0x1234567, i), CScript(),
+                                0xffff_fffe - i))
+        for i in range(2):
+            tx.vout.append(CTxOut(1000 + i, CScript(
+                [OP_HASH160, i.to_bytes(20, 'big'), OP_EQUAL])))
+        tx.nLockTime = 1234
+        spent_utxos = [CTxOut(5000 + i, CScript([OP_TRUE, i]))
+                       for i in range(3)]
+
+        context = LotusSighashContext(tx, spent_utxos)
+        self.assertEqual(
+            context.sighash(SIGHASH_ALL | SIGHASH_LOTUS, 1).hex(),
+            "c2ad7df276287f63d1fadefefc9881cbfac44cb183435f5e9a498676455ec2fa")
+        self.assertEqual(
+            context.sighash(
+                SIGHASH_SINGLE | SIGHASH_LOTUS | SIGHASH_ANYONECANPAY, 0,
+                hash256(b'script'), 7).hex(),
+            "a3168c851f3750e9f52fb6acfe14e87a1884e8e1ecf4e4f9c6f28934992592db")
+        # The cached components are reused across inputs and sighash types
+        for sig_hash_type in [SIGHASH_ALL, SIGHASH_NONE, SIGHASH_SINGLE]:
+            for in_type in [0, SIGHASH_ANYONECANPAY]:
+                for input_index in range(2):
+                    args = (sig_hash_type | SIGHASH_LOTUS | in_type,
+                            input_index, hash256(b'script'), 7)
+                    self.assertEqual(
+                        context.sighash(*args),
+                        SignatureHashLotus(tx, spent_utxos, *args))
+        with self.assertRaises(ValueError):
+            context.sighash(SIGHASH_SINGLE | SIGHASH_LOTUS, 2)
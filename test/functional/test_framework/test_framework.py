@@ -5,6 +5,7 @@
 """Base class for RPC testing."""
 
 import argparse
+import collections
 import configparser
 import logging
 import os
@@ -14,12 +15,15 @@ import shutil
 import sys
 import tempfile
 import time
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 from typing import List
 
 from . import coverage
+from .address import ADDRESS_ECREG_P2SH_OP_TRUE
 from .authproxy import JSONRPCException
 from .avatools import get_proof_ids
+from .key import get_native_backend, set_native_backend
 from .p2p import NetworkThread
 from .test_node import TestNode
 from .util import (
@@ -27,6 +31,7 @@ from .util import (
     PortSeed,
     assert_equal,
     check_json_precision,
+    clone_datadir,
     get_datadir_path,
     initialize_datadir,
     p2p_port,
@@ -51,6 +56,44 @@ TIMESTAMP_IN_THE_PAST = 1575158400
 TMPDIR_PREFIX = "bitcoin_func_test_"
 
 
+def _build_cache_199_blocks(cache_node):
+    # Create a 199-block-long chain; each of the 4 first nodes
+    # gets 25 mature blocks and 25 immature.
+    # The 4th node gets only 24 immature blocks so that the very last
+    # block in the cache does not age too much (have an old tip age).
+    # This is needed so that we are out of IBD when the test starts,
+    # see the tip age check in IsInitialBlockDownload().
+    for i in range(8):
+        cache_node.generatetoaddress(
+            nblocks=25 if i != 7 else 24,
+            address=TestNode.PRIV_KEYS[i % 4].address,
+        )
+
+
+def _build_cache_miniwallet(cache_node):
+    # The 199-block-long chain, followed by 200 blocks paying to the MiniWallet
+    # address, 100 of them mature. See MiniWallet.scan_blocks().
+    _build_cache_199_blocks(cache_node)
+    assert_equal(cache_node.getblockcount() + 1, MINIWALLET_CACHE_START_HEIGHT)
+    cache_node.generatetoaddress(
+        nblocks=200, address=ADDRESS_ECREG_P2SH_OP_TRUE)
+
+
+# The pre-mined chains a test can start from, see chain_cache_profile. Bump the
+# version of a profile when changing how it is built, so that stale caches are
+# not reused.
+ChainCacheProfile = collections.namedtuple(
+    'ChainCacheProfile', ['version', 'height', 'build'])
+CHAIN_CACHE_PROFILES = {
+    "199-blocks": ChainCacheProfile(1, 199, _build_cache_199_blocks),
+    "miniwallet": ChainCacheProfile(1, 399, _build_cache_miniwallet),
+}
+DEFAULT_CHAIN_CACHE_PROFILE = "199-blocks"
+# The height of the first block paying to MiniWallet in the "miniwallet"
+# profile, for MiniWallet.scan_blocks()
+MINIWALLET_CACHE_START_HEIGHT = CHAIN_CACHE_PROFILES["199-blocks"].height + 1
+
+
 class SkipTest(Exception):
     """This exception is raised to skip a test"""
 
@@ -98,8 +141,12 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         """Sets test framework defaults. Do not override this method. Instead, override the set_test_params() method"""
         self.chain: str = 'regtest'
         self.setup_clean_chain: bool = False
+        # The pre-mined chain the nodes start from, unless setup_clean_chain
+        self.chain_cache_profile: str = DEFAULT_CHAIN_CACHE_PROFILE
         self.nodes: List[TestNode] = []
         self.network_thread = None
+        # Number of event loop threads the P2P connections are spread across
+        self.network_thread_shards = 1
         # Wait for up to 60 seconds for the RPC server to respond
         self.rpc_timeout = 60
         self.supports_cli = True
@@ -184,6 +231,8 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
                             help="set a random seed for deterministically reproducing a previous test run")
         parser.add_argument("--descriptors", default=False, action="store_true",
                             help="Run test using a descriptor wallet")
+        parser.add_argument("--nonativekeys", dest="nativekeys", default=True, action="store_false",
+                            help="Sign and verify with the pure Python secp256k1 implementation, even if the libsecp256k1 shared library is available (see LIBSECP256K1)")
         parser.add_argument("--with-exodusactivation", dest="exodusactivation", default=False, action="store_true",
                             help="Activate exodus update on timestamp {}".format(TIMESTAMP_IN_THE_PAST))
         parser.add_argument(
@@ -227,6 +276,18 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
             config['environment']['BUILDDIR'] + os.path.sep + "qt" + os.pathsep + \
             os.environ['PATH']
 
+        # Delegate the key operations to libsecp256k1 if it was built as a
+        # shared library
+        fname_libsecp256k1 = os.path.join(
+            config["environment"]["BUILDDIR"],
+            "src",
+            "secp256k1",
+            "libsecp256k1.so"
+        )
+        set_native_backend(
+            os.getenv("LIBSECP256K1", default=fname_libsecp256k1)
+            if self.options.nativekeys else None)
+
         # Add generated NNG flatbuffer files to PYTHONPATH
         sys.path.append(os.path.join(config['environment']['BUILDDIR'],
                                      'src',
@@ -255,9 +316,12 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
 
         random.seed(seed)
         self.log.debug("PRNG seed is: {}".format(seed))
+        self.log.debug("Using the {} secp256k1 implementation".format(
+            "libsecp256k1" if get_native_backend() else "Python"))
 
         self.log.debug('Setting up network thread')
-        self.network_thread = NetworkThread()
+        self.network_thread = NetworkThread(
+            num_shards=self.network_thread_shards)
         self.network_thread.start()
 
         if self.options.usecli:
@@ -397,8 +461,9 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         if self.is_wallet_compiled():
             self.import_deterministic_coinbase_privkeys()
         if not self.setup_clean_chain:
+            height = CHAIN_CACHE_PROFILES[self.chain_cache_profile].height
             for n in self.nodes:
-                assert_equal(n.getblockchaininfo()["blocks"], 199)
+                assert_equal(n.getblockchaininfo()["blocks"], height)
             # To ensure that all nodes are out of IBD, the most recent block
             # must have a timestamp not too old (see IsInitialBlockDownload()).
             self.log.debug('Generate a block with current time')
@@ -407,7 +472,7 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
             for n in self.nodes:
                 n.submitblock(block)
                 chain_info = n.getblockchaininfo()
-                assert_equal(chain_info["blocks"], 200)
+                assert_equal(chain_info["blocks"], height + 1)
                 assert_equal(chain_info["initialblockdownload"], False)
 
     def import_deterministic_coinbase_privkeys(self):
@@ -496,8 +561,9 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         try:
             for i, node in enumerate(self.nodes):
                 node.start(extra_args[i], *args, **kwargs)
-            for node in self.nodes:
-                node.wait_for_rpc_connection()
+            # Wait for all the nodes to be ready concurrently
+            self._run_on_nodes(
+                lambda node: node.wait_for_rpc_connection(), "started")
         except BaseException:
             # If one node failed to start, stop the others
             self.stop_nodes()
@@ -514,14 +580,31 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
 
     def stop_nodes(self, wait=0):
         """Stop multiple lotusd test nodes"""
-        for node in self.nodes:
-            # Issue RPC to stop nodes
+        def stop_node(node):
+            # Issue RPC to stop the node, and wait for it to stop
             node.stop_node(wait=wait, wait_until_stopped=False)
-
-        for node in self.nodes:
-            # Wait for nodes to stop
             node.wait_until_stopped()
 
+        self._run_on_nodes(stop_node, "stopped")
+
+    def _run_on_nodes(self, func, action):
+        """Call func(node) for all the nodes concurrently, logging how long
+        each took, and re-raise the first exception if any failed."""
+        def run(node):
+            start_time = time.time()
+            func(node)
+            self.log.debug("Node {} {} in {:.2f}s".format(
+                node.index, action, time.time() - start_time))
+
+        if len(self.nodes) <= 1:
+            for node in self.nodes:
+                run(node)
+            return
+        with ThreadPoolExecutor(max_workers=len(self.nodes)) as executor:
+            futures = [executor.submit(run, node) for node in self.nodes]
+        for future in futures:
+            future.result()
+
     def restart_node(self, i, extra_args=None):
         """Stop and start a test node"""
         self.stop_node(i)
@@ -606,13 +689,17 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         rpc_connections = nodes or self.nodes
         timeout = int(timeout * self.options.timeout_factor)
         stop_time = time.time() + timeout
+        # Poll quickly at first, since nodes are often synced within a few
+        # milliseconds, then back off to polling every `wait` seconds
+        poll_interval = 0.05
         while time.time() <= stop_time:
             best_hash = [x.getbestblockhash() for x in rpc_connections]
             if best_hash.count(best_hash[0]) == len(rpc_connections):
                 return
             # Check that each peer has at least one connection
             assert (all([len(x.getpeerinfo()) for x in rpc_connections]))
-            time.sleep(wait)
+            time.sleep(min(wait, poll_interval))
+            poll_interval *= 2
         raise AssertionError("Block sync timed out after {}s:{}".format(
             timeout,
             "".join("\n  {!r}".format(b) for b in best_hash),
@@ -627,6 +714,7 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         rpc_connections = nodes or self.nodes
         timeout = int(timeout * self.options.timeout_factor)
         stop_time = time.time() + timeout
+        poll_interval = 0.05
         while time.time() <= stop_time:
             pool = [set(r.getrawmempool()) for r in rpc_connections]
             if pool.count(pool[0]) == len(rpc_connections):
@@ -636,7 +724,8 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
                 return
             # Check that each peer has at least one connection
             assert (all([len(x.getpeerinfo()) for x in rpc_connections]))
-            time.sleep(wait)
+            time.sleep(min(wait, poll_interval))
+            poll_interval *= 2
         raise AssertionError("Mempool sync timed out after {}s:{}".format(
             timeout,
             "".join("\n  {!r}".format(m) for m in pool),
@@ -654,6 +743,7 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
             """Convert ProodIDs to hex strings for easier debugging"""
             return list(f"{i:064x}" for i in id_list)
 
+        poll_interval = 0.05
         while time.time() <= stop_time:
             nodes_proofs = [
                 set(format_ids(get_proof_ids(r))) for r in rpc_connections]
@@ -661,7 +751,8 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
                 return
             # Check that each peer has at least one connection
             assert (all([len(x.getpeerinfo()) for x in rpc_connections]))
-            time.sleep(wait)
+            time.sleep(min(wait, poll_interval))
+            poll_interval *= 2
         raise AssertionError("Proofs sync timed out after {}s:{}".format(
             timeout,
             "".join("\n  {!r}".format(m) for m in nodes_proofs),
@@ -715,12 +806,17 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
     def _initialize_chain(self):
         """Initialize a pre-mined blockchain for use by the test.
 
-        Create a cache of a 199-block-long chain
-        Afterward, create num_nodes copies from the cache."""
+        Create a cache of the chain_cache_profile chain if it does not exist
+        yet (by default 199-block-long). Afterward, create num_nodes copies
+        from the cache."""
 
         # Use node 0 to create the cache for all other nodes
         CACHE_NODE_ID = 0
-        cache_node_dir = get_datadir_path(self.options.cachedir, CACHE_NODE_ID)
+        profile = CHAIN_CACHE_PROFILES[self.chain_cache_profile]
+        cache_dir = os.path.join(
+            self.options.cachedir,
+            "{}-v{}".format(self.chain_cache_profile, profile.version))
+        cache_node_dir = get_datadir_path(cache_dir, CACHE_NODE_ID)
         assert self.num_nodes <= MAX_NODES
 
         if not os.path.isdir(cache_node_dir):
@@ -728,7 +824,7 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
                 "Creating cache directory {}".format(cache_node_dir))
 
             initialize_datadir(
-                self.options.cachedir,
+                cache_dir,
                 CACHE_NODE_ID,
                 self.chain,
                 self.disable_autoconnect)
@@ -767,19 +863,9 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
                 cache_node.getblockheader(
                     cache_node.getbestblockhash())['time'])
 
-            # Create a 199-block-long chain; each of the 4 first nodes
-            # gets 25 mature blocks and 25 immature.
-            # The 4th node gets only 24 immature blocks so that the very last
-            # block in the cache does not age too much (have an old tip age).
-            # This is needed so that we are out of IBD when the test starts,
-            # see the tip age check in IsInitialBlockDownload().
-            for i in range(8):
-                cache_node.generatetoaddress(
-                    nblocks=25 if i != 7 else 24,
-                    address=TestNode.PRIV_KEYS[i % 4].address,
-                )
-
-            assert_equal(cache_node.getblockchaininfo()["blocks"], 199)
+            profile.build(cache_node)
+            assert_equal(
+                cache_node.getblockchaininfo()["blocks"], profile.height)
 
             # Shut it down, and clean up cache directories:
             self.stop_nodes()
@@ -800,7 +886,7 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
                 "Copy cache directory {} to node {}".format(
                     cache_node_dir, i))
             to_dir = get_datadir_path(self.options.tmpdir, i)
-            shutil.copytree(cache_node_dir, to_dir)
+            clone_datadir(cache_node_dir, to_dir)
             # Overwrite port/rpcport in lotus.conf
             initialize_datadir(
                 self.options.tmpdir,
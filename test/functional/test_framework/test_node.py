@@ -21,7 +21,13 @@ import time
 import urllib.parse
 from enum import Enum
 
-from .authproxy import JSONRPCException
+from .authproxy import (
+    DEFAULT_RPC_THREADS,
+    DEFAULT_RPC_WORKQUEUE,
+    AuthServiceProxyPool,
+    JSONRPCException,
+    RPCBatch,
+)
 from .descriptors import descsum_create
 from .messages import COIN, CTransaction, FromHex
 from .p2p import P2P_SUBVERSION
@@ -147,6 +153,7 @@ class TestNode():
         self.rpc_connected = False
         self.rpc = None
         self.url = None
+        self.start_args = []
         self.relay_fee_cache = None
         self.log = logging.getLogger('TestFramework.node{}'.format(i))
         # Whether to kill the node when this object goes away
@@ -280,7 +287,8 @@ class TestNode():
         # written to stderr and not the terminal
         subp_env = dict(os.environ, LIBC_FATAL_STDERR_="1")
 
-        p_args = [self.binary] + self.default_args + extra_args
+        self.start_args = self.default_args + extra_args
+        p_args = [self.binary] + self.start_args
         if self.emulator is not None:
             p_args = [self.emulator] + p_args
         self.process = subprocess.Popen(
@@ -299,9 +307,12 @@ class TestNode():
 
     def wait_for_rpc_connection(self):
         """Sets up an RPC connection to the lotusd process. Returns False if unable to connect."""
-        # Poll at a rate of four times per second
-        poll_per_s = 4
-        for _ in range(poll_per_s * self.rpc_timeout):
+        # Poll with an exponentially increasing delay, starting short since
+        # lotusd is often ready within a few tens of milliseconds, and then at
+        # a rate of four times per second
+        poll_delay = 0.01
+        time_end = time.time() + self.rpc_timeout
+        while time.time() < time_end:
             if self.process.poll() is not None:
                 raise FailedToStartError(self._node_msg(
                     'lotusd exited with status {} during initialization'.format(self.process.returncode)))
@@ -372,7 +383,8 @@ class TestNode():
                 # lotusd is still starting
                 if "No RPC credentials" not in str(e):
                     raise
-            time.sleep(1.0 / poll_per_s)
+            time.sleep(poll_delay)
+            poll_delay = min(poll_delay * 2, 0.25)
         self._raise_assertion_error(
             "Unable to connect to lotusd after {}s".format(
                 self.rpc_timeout))
@@ -404,6 +416,23 @@ class TestNode():
         return self.generatetoaddress(
             nblocks=nblocks, address=self.get_deterministic_priv_key().address, maxtries=maxtries)
 
+    def get_rpc_pool(self, size=None):
+        """Return a pool of `size` RPC connections to the node, by default as
+        many as the node has RPC threads."""
+        assert self.rpc_connected, self._node_msg("Error: RPC not connected")
+
+        def get_arg(name, default):
+            value = default
+            for arg in self.start_args:
+                if arg.startswith(name + '='):
+                    value = int(arg.split('=', 1)[1])
+            return value
+        rpcthreads = get_arg('-rpcthreads', DEFAULT_RPC_THREADS)
+        rpcworkqueue = get_arg('-rpcworkqueue', DEFAULT_RPC_WORKQUEUE)
+        return AuthServiceProxyPool(
+            self.url, size=size or rpcthreads, rpcthreads=rpcthreads,
+            rpcworkqueue=rpcworkqueue, timeout=self.rpc_timeout)
+
     def get_wallet_rpc(self, wallet_name):
         if self.use_cli:
             return RPCOverloadWrapper(
@@ -820,6 +849,9 @@ class TestNodeCLI():
     def __getattr__(self, command):
         return TestNodeCLIAttr(self, command)
 
+    def batched(self, *args, **kwargs):
+        return RPCBatch(self, *args, **kwargs)
+
     def batch(self, requests):
         results = []
         for request in requests:
@@ -9,6 +9,9 @@ import json
 import logging
 import os
 import re
+import shutil
+import tempfile
+import threading
 import time
 import unittest
 from base64 import b64encode
@@ -21,6 +24,12 @@ from typing import Callable, Optional
 from . import coverage
 from .authproxy import AuthServiceProxy, JSONRPCException
 
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows
+    fcntl = None  # type: ignore
+
 logger = logging.getLogger("TestFramework.utils")
 
 # Assert functions
@@ -259,6 +268,9 @@ def wait_until_helper(predicate, *, attempts=float('inf'),
     from `BitcoinTestFramework` or `P2PInterface` class ensures the timeout is
     properly scaled. Furthermore, `wait_until()` from `P2PInterface` class in
     `p2p.py` has a preset lock.
+
+    If lock is a threading.Condition, the predicate is also re-evaluated as
+    soon as the condition is notified, instead of only every 50 ms.
     """
     if attempts == float('inf') and timeout == float('inf'):
         timeout = 60
@@ -271,6 +283,10 @@ def wait_until_helper(predicate, *, attempts=float('inf'),
             with lock:
                 if predicate():
                     return
+                if isinstance(lock, threading.Condition):
+                    attempt += 1
+                    lock.wait(timeout=0.05)
+                    continue
         else:
             if predicate():
                 return
@@ -395,6 +411,53 @@ def get_datadir_path(dirname, n):
     return os.path.join(dirname, "node" + str(n))
 
 
+# Linux ioctl to share the data of a file with another one (copy-on-write),
+# on filesystems that support it (e.g. btrfs, xfs)
+FICLONE = 0x40049409
+BLOCK_FILE_REGEX = re.compile(r'blk\d{5}\.dat')
+
+
+def clone_file(src, dst):
+    """Copy the file src to dst, as a reflink if the filesystem supports it."""
+    if fcntl is not None:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                reflinked = True
+            except OSError:
+                reflinked = False
+        if reflinked:
+            shutil.copystat(src, dst)
+            return dst
+    return shutil.copy2(src, dst)
+
+
+def clone_datadir(src, dst):
+    """Copy the datadir src to dst, sharing the file contents where possible.
+
+    The block files which precede the last one are never modified again by
+    lotusd, so they are hardlinked. The undo files are not: a -reindex
+    rewrites their undo data in place. They and the other files are
+    reflinked, or copied if that is not supported."""
+    immutable = set()
+    for dirpath, _, filenames in os.walk(src):
+        block_files = sorted(
+            name for name in filenames if BLOCK_FILE_REGEX.fullmatch(name))
+        immutable.update(
+            os.path.join(dirpath, name) for name in block_files[:-1])
+
+    def copy_function(s, d):
+        if s in immutable:
+            try:
+                os.link(s, d)
+                return d
+            except OSError:
+                pass
+        return clone_file(s, d)
+
+    shutil.copytree(src, dst, copy_function=copy_function)
+
+
 def append_config(datadir, options):
     with open(os.path.join(datadir, "lotus.conf"), 'a', encoding='utf8') as f:
         for option in options:
@@ -553,3 +616,36 @@ class TestFrameworkUtil(unittest.TestCase):
 
         for a, n in test_vectors:
             self.assertEqual(modinv(a, n), pow(a, n - 2, n))
+
+    def test_wait_until_condition(self):
+        condition = threading.Condition(threading.Lock())
+        state = []
+
+        def notify():
+            with condition:
+                state.append(True)
+                condition.notify_all()
+        threading.Timer(0.1, notify).start()
+        wait_until_helper(lambda: state, lock=condition, timeout=10)
+        self.assertEqual(state, [True])
+
+    def test_clone_datadir(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            src = os.path.join(tmpdir, "src")
+            os.makedirs(os.path.join(src, "regtest", "blocks", "index"))
+            files = ["blk00000.dat", "blk00001.dat", "rev00000.dat",
+                     "rev00001.dat", "index/000003.log", "index/CURRENT"]
+            for i, name in enumerate(files):
+                with open(os.path.join(src, "regtest", "blocks", name),
+                          'wb') as f:
+                    f.write(bytes([i]) * 100)
+
+            dst = os.path.join(tmpdir, "dst")
+            clone_datadir(src, dst)
+            for i, name in enumerate(files):
+                src_file = os.path.join(src, "regtest", "blocks", name)
+                dst_file = os.path.join(dst, "regtest", "blocks", name)
+                with open(dst_file, 'rb') as f:
+                    self.assertEqual(f.read(), bytes([i]) * 100)
+                self.assertEqual(os.path.samefile(src_file, dst_file),
+                                 name == "blk00000.dat")
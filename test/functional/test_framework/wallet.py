@@ -29,13 +29,36 @@ class MiniWallet:
         """Generate blocks with coinbase outputs to the internal address,
         and append the outputs to the internal list"""
         blocks = self._test_node.generatetoaddress(num_blocks, self._address)
-        for b in blocks:
-            cb_tx = self._test_node.getblock(blockhash=b, verbosity=2)['tx'][0]
+        with self._test_node.batched() as batch:
+            block_futures = [batch.getblock(blockhash=b, verbosity=2)
+                             for b in blocks]
+        for block in block_futures:
+            cb_tx = block.result()['tx'][0]
             print(cb_tx)
             self._utxos.append(
                 {'txid': cb_tx['txid'], 'vout': 1, 'value': cb_tx['vout'][1]['value']})
         return blocks
 
+    def scan_blocks(self, *, start=1, num):
+        """Append the coinbase outputs to the internal address found in the
+        num blocks from height start, e.g. those pre-mined by the
+        "miniwallet" chain cache profile. The caller picks the range, the
+        outputs are not checked for maturity."""
+        with self._test_node.batched() as batch:
+            hash_futures = [batch.getblockhash(height=h)
+                            for h in range(start, start + num)]
+        with self._test_node.batched() as batch:
+            block_futures = [batch.getblock(blockhash=f.result(), verbosity=2)
+                             for f in hash_futures]
+        script_hex = self._scriptPubKey.hex()
+        for block in block_futures:
+            cb_tx = block.result()['tx'][0]
+            for vout in cb_tx['vout']:
+                if vout['scriptPubKey']['hex'] == script_hex:
+                    self._utxos.append(
+                        {'txid': cb_tx['txid'], 'vout': vout['n'],
+                         'value': vout['value']})
+
     def get_utxo(self, *, txid: Optional[str] = ''):
         """
         Returns a utxo and marks it as spent (pops it from the internal list)
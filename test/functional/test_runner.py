@@ -16,6 +16,7 @@ For a description of arguments recognized by test scripts, see
 import argparse
 import configparser
 import datetime
+import heapq
 import json
 import logging
 import multiprocessing
@@ -74,11 +75,18 @@ if os.name != 'nt' or sys.getwindowsversion() >= (10, 0, 14393):  # type: ignore
 TEST_EXIT_PASSED = 0
 TEST_EXIT_SKIPPED = 77
 
+# Matches the chain_cache_profile a test sets in set_test_params()
+CHAIN_CACHE_PROFILE_REGEX = re.compile(
+    r"chain_cache_profile\s*=\s*[\"']([\w.-]+)[\"']")
+
 TEST_FRAMEWORK_MODULES = [
     "address",
+    "authproxy",
     "blocktools",
+    "key",
     "messages",
     "muhash",
+    "p2p",
     "script",
     "txtools",
     "util",
@@ -135,6 +143,12 @@ TEST_PARAMS = {
 # EXTENDED_CUTOFF
 DEFAULT_EXTENDED_CUTOFF = 40
 DEFAULT_JOBS = (multiprocessing.cpu_count() // 3) + 1
+# Unless --maxnodes is specified, limit the number of nodes running
+# concurrently across all the jobs to this many per job
+DEFAULT_MAX_NODES_PER_JOB = 4
+
+# Matches the num_nodes a test sets in set_test_params()
+NUM_NODES_REGEX = re.compile(r"self\.num_nodes\s*=\s*(\d+)")
 
 
 class TestCase():
@@ -143,13 +157,16 @@ class TestCase():
     """
 
     def __init__(self, test_num, test_case, tests_dir,
-                 tmpdir, failfast_event, flags=None):
+                 tmpdir, failfast_event, flags=None, predicted_time=0,
+                 num_nodes=1):
         self.tests_dir = tests_dir
         self.tmpdir = tmpdir
         self.test_case = test_case
         self.test_num = test_num
         self.failfast_event = failfast_event
         self.flags = flags
+        self.predicted_time = predicted_time
+        self.num_nodes = num_nodes
 
     def run(self):
         if self.failfast_event.is_set():
@@ -204,6 +221,12 @@ def main():
 
     # SRCDIR must be set for cdefs.py to find and parse consensus.h
     os.environ["SRCDIR"] = src_dir
+    # Let the test framework unit tests cross-check the key operations
+    # against libsecp256k1, if it was built as a shared library
+    libsecp256k1 = os.path.join(
+        build_dir, "src", "secp256k1", "libsecp256k1.so")
+    if os.path.isfile(libsecp256k1):
+        os.environ.setdefault("LIBSECP256K1", libsecp256k1)
 
     # Parse arguments and pass through unrecognised args
     parser = argparse.ArgumentParser(add_help=False,
@@ -228,6 +251,8 @@ def main():
                         action='store_true', help='print help text and exit')
     parser.add_argument('--jobs', '-j', type=int, default=DEFAULT_JOBS,
                         help='how many test scripts to run in parallel.')
+    parser.add_argument('--maxnodes', type=int, default=None,
+                        help='the maximum number of nodes running concurrently across all the jobs (default: {} per job). A test with more nodes still runs, alone.'.format(DEFAULT_MAX_NODES_PER_JOB))
     parser.add_argument('--keepcache', '-k', action='store_true',
                         help='the default behavior is to flush the cache directory on startup. --keepcache retains the cache from the previous testrun.')
     parser.add_argument('--quiet', '-q', action='store_true',
@@ -367,12 +392,15 @@ def main():
         args=passon_args,
         combined_logs_len=args.combinedlogslen,
         build_timings=build_timings,
-        failfast=args.failfast
+        failfast=args.failfast,
+        src_timings=src_timings,
+        max_nodes=args.maxnodes
     )
 
 
 def run_tests(test_list, build_dir, tests_dir, junitoutput, tmpdir, num_jobs, test_suite_name,
-              enable_coverage=False, args=None, combined_logs_len=0, build_timings=None, failfast=False):
+              enable_coverage=False, args=None, combined_logs_len=0, build_timings=None, failfast=False,
+              src_timings=None, max_nodes=None):
     args = args or []
 
     # Warn if lotusd is already running
@@ -417,18 +445,16 @@ def run_tests(test_list, build_dir, tests_dir, junitoutput, tmpdir, num_jobs, te
         coverage = None
 
     if len(test_list) > 1 and num_jobs > 1:
-        # Populate cache
-        try:
-            subprocess.check_output([sys.executable, os.path.join(
-                tests_dir, 'create_cache.py')] + flags + [os.path.join("--tmpdir={}", "cache") .format(tmpdir)])
-        except subprocess.CalledProcessError as e:
-            sys.stdout.buffer.write(e.output)
-            raise
+        # Populate the caches of all the chain profiles used by the tests,
+        # in parallel
+        create_caches(get_chain_cache_profiles(test_list, tests_dir),
+                      tests_dir, tmpdir, flags)
 
     # Run Tests
     start_time = time.time()
     test_results = execute_test_processes(
-        num_jobs, test_list, tests_dir, tmpdir, flags, failfast)
+        num_jobs, test_list, tests_dir, tmpdir, flags, failfast, src_timings,
+        max_nodes)
     runtime = time.time() - start_time
 
     max_len_name = len(max(test_list, key=len))
@@ -463,10 +489,140 @@ def run_tests(test_list, build_dir, tests_dir, junitoutput, tmpdir, num_jobs, te
     sys.exit(not all_passed)
 
 
+def get_chain_cache_profiles(test_list, tests_dir):
+    """Return the chain cache profiles the tests start from, see
+    BitcoinTestFramework.chain_cache_profile"""
+    # Imported here, the test framework needs SRCDIR to be set, see main()
+    from test_framework.test_framework import DEFAULT_CHAIN_CACHE_PROFILE
+    profiles = {DEFAULT_CHAIN_CACHE_PROFILE}
+    for test in test_list:
+        try:
+            with open(os.path.join(tests_dir, test.split()[0]),
+                      encoding="utf8") as f:
+                profiles.update(CHAIN_CACHE_PROFILE_REGEX.findall(f.read()))
+        except OSError:
+            # Missing tests are reported when they are run
+            pass
+    return sorted(profiles)
+
+
+def create_caches(profiles, tests_dir, tmpdir, flags):
+    """Run one create_cache.py process per chain cache profile"""
+    procs = []
+    for profile in profiles:
+        log_stdout = tempfile.SpooledTemporaryFile(max_size=2**16)
+        proc = subprocess.Popen(
+            [sys.executable, os.path.join(tests_dir, 'create_cache.py')] +
+            flags + ["--tmpdir={}".format(
+                os.path.join(tmpdir, "cache-{}".format(profile))),
+                "--cacheprofile={}".format(profile)],
+            stdout=log_stdout, stderr=subprocess.STDOUT)
+        procs.append((proc, log_stdout))
+    for proc, log_stdout in procs:
+        proc.wait()
+    for proc, log_stdout in procs:
+        if proc.returncode != 0:
+            log_stdout.seek(0)
+            output = log_stdout.read()
+            sys.stdout.buffer.write(output)
+            raise subprocess.CalledProcessError(
+                proc.returncode, proc.args, output=output)
+        log_stdout.close()
+
+
+def get_num_nodes(test, tests_dir):
+    """Return the number of nodes a test starts, as set in set_test_params().
+    Tests setting several values, e.g. depending on their parameters, are
+    assumed to start the largest number of nodes."""
+    try:
+        with open(os.path.join(tests_dir, test.split()[0]),
+                  encoding="utf8") as f:
+            return max(map(int, NUM_NODES_REGEX.findall(f.read())),
+                       default=1)
+    except OSError:
+        return 1
+
+
+class TestScheduler():
+    """
+    Hands the tests over to the jobs, longest predicted duration first, while
+    keeping the number of nodes running concurrently within max_nodes.
+
+    Each job picks the next test when it becomes free, so that the schedule
+    rebalances itself when the tests run faster or slower than predicted.
+    When the longest pending test would exceed max_nodes, a shorter one that
+    fits runs in the meantime.
+    """
+
+    def __init__(self, test_cases, max_nodes):
+        # Longest-processing-time first. Ties (e.g. unknown timings) are
+        # broken by the number of nodes, then by name.
+        self.pending = sorted(
+            test_cases,
+            key=lambda t: (-t.predicted_time, -t.num_nodes, t.test_case))
+        self.max_nodes = max_nodes
+        self.running_nodes = 0
+        self.running_tests = 0
+        self.cond = threading.Condition()
+
+    def _pop_next(self, pending, running_nodes, running_tests):
+        for i, test in enumerate(pending):
+            # A test with more nodes than max_nodes runs alone
+            if (running_nodes + test.num_nodes <= self.max_nodes
+                    or running_tests == 0):
+                return pending.pop(i)
+        return None
+
+    def next_test(self):
+        """Block until a test can be run, return None when all tests have
+        been handed over"""
+        with self.cond:
+            while self.pending:
+                test = self._pop_next(
+                    self.pending, self.running_nodes, self.running_tests)
+                if test is not None:
+                    self.running_nodes += test.num_nodes
+                    self.running_tests += 1
+                    return test
+                self.cond.wait()
+            return None
+
+    def task_done(self, test):
+        with self.cond:
+            self.running_nodes -= test.num_nodes
+            self.running_tests -= 1
+            self.cond.notify_all()
+
+    def predict_makespan(self, num_jobs):
+        """Simulate the schedule with the predicted durations, return the
+        predicted total runtime and its lower bound (the longest test or the
+        total duration spread evenly across the jobs)"""
+        pending = list(self.pending)
+        # (end time, tie breaker, test) of the running tests
+        running = []
+        running_nodes = 0
+        now = 0
+        while pending or running:
+            while pending and len(running) < num_jobs:
+                test = self._pop_next(pending, running_nodes, len(running))
+                if test is None:
+                    break
+                running_nodes += test.num_nodes
+                heapq.heappush(
+                    running, (now + test.predicted_time, test.test_num, test))
+            now, _, test = heapq.heappop(running)
+            running_nodes -= test.num_nodes
+
+        durations = [t.predicted_time for t in self.pending]
+        lower_bound = max(max(durations, default=0),
+                          sum(durations) / max(num_jobs, 1))
+        return now, lower_bound
+
+
 def execute_test_processes(
-        num_jobs, test_list, tests_dir, tmpdir, flags, failfast=False):
+        num_jobs, test_list, tests_dir, tmpdir, flags, failfast=False,
+        timings=None, max_nodes=None):
     update_queue = Queue()
-    job_queue = Queue()
     failfast_event = threading.Event()
     test_results = []
     poll_timeout = 10  # seconds
@@ -548,7 +704,7 @@ def execute_test_processes(
         It also reports start and result messages to handle_update_messages
         """
         while True:
-            test = job_queue.get()
+            test = scheduler.next_test()
             if test is None:
                 break
             # Signal that the test is starting to inform the poor waiting
@@ -556,37 +712,60 @@ def execute_test_processes(
             update_queue.put(test)
             result = test.run()
             update_queue.put(result)
-            job_queue.task_done()
+            scheduler.task_done(test)
 
     ##
     # Setup our threads, and start sending tasks
     ##
 
+    # Schedule our test cases, using the durations of the previous runs.
+    # Tests that never ran are predicted to last as long as the median test.
+    known_times = sorted(
+        t for t in (timings.get_time(test) if timings else None
+                    for test in test_list) if t is not None)
+    default_time = known_times[len(known_times) // 2] if known_times else 0
+    test_cases = []
+    for i, t in enumerate(test_list):
+        predicted_time = timings.get_time(t) if timings else None
+        test_cases.append(TestCase(
+            i, t, tests_dir, tmpdir, failfast_event, flags,
+            predicted_time=default_time if predicted_time is None else predicted_time,
+            num_nodes=get_num_nodes(t, tests_dir)))
+    scheduler = TestScheduler(
+        test_cases, max_nodes or num_jobs * DEFAULT_MAX_NODES_PER_JOB)
+    predicted_makespan, lower_bound = scheduler.predict_makespan(num_jobs)
+    logging.debug(
+        "Predicted runtime: {} s (lower bound: {} s, max nodes: {})".format(
+            TimeResolution.seconds(predicted_makespan),
+            TimeResolution.seconds(lower_bound), scheduler.max_nodes))
+
     # Start our result collection thread.
     resultCollector = threading.Thread(target=handle_update_messages)
     resultCollector.daemon = True
     resultCollector.start()
 
-    # Start some worker threads
+    # Start some worker threads, they exit once all the tests are handed over
+    start_time = time.time()
+    workers = []
     for _ in range(num_jobs):
         t = threading.Thread(target=handle_test_cases)
         t.daemon = True
         t.start()
-
-    # Push all our test cases into the job queue.
-    for i, t in enumerate(test_list):
-        job_queue.put(TestCase(i, t, tests_dir, tmpdir, failfast_event, flags))
+        workers.append(t)
 
     # Wait for all the jobs to be completed
-    job_queue.join()
+    for t in workers:
+        t.join()
 
     # Wait for all the results to be compiled
     update_queue.join()
 
-    # Flush our queues so the threads exit
+    # Flush our queue so the thread exits
     update_queue.put(None)
-    for _ in range(num_jobs):
-        job_queue.put(None)
+
+    logging.debug("Predicted runtime: {} s, actual runtime: {} s".format(
+        TimeResolution.seconds(predicted_makespan),
+        TimeResolution.seconds(time.time() - start_time)))
 
     return test_results
 
@@ -729,8 +908,7 @@ def get_tests_to_run(test_list, test_params, cutoff, src_timings):
 
     def get_test_time(test):
         # Return 0 if test is unknown to always run it
-        return next(
-            (x['time'] for x in src_timings.existing_timings if x['name'] == test), 0)
+        return src_timings.get_time(test) or 0
 
     # Some tests must also be run with additional parameters. Add them to the
     # list.
@@ -867,6 +1045,12 @@ class Timings():
     def __init__(self, timing_file):
         self.timing_file = timing_file
         self.existing_timings = self.load_timings()
+        self.times_by_name = {
+            t['name']: t['time'] for t in self.existing_timings}
+
+    def get_time(self, test_name):
+        """Return the last recorded duration of a test, None if unknown"""
+        return self.times_by_name.get(test_name)
 
     def load_timings(self):
         if os.path.isfile(self.timing_file):